@@ -0,0 +1,45 @@
+"""
+Compares the default image path of rotate_and_scale_image with the fast path
+(image_fast=True) and the output formats.
+
+    python benchmarks/bench_image.py [repeat]
+"""
+import sys
+import timeit
+from io import BytesIO
+
+from PIL import Image
+
+from postcard_creator.imaging import rotate_and_scale_image
+
+SIZES = [(1600, 1200), (4032, 3024), (3024, 4032), (8000, 6000)]
+VARIANTS = [
+    ('default png', {}),
+    ('fast png', {'image_fast': True}),
+    ('fast jpeg', {'image_fast': True, 'image_format': 'JPEG'}),
+    ('fast webp', {'image_fast': True, 'image_format': 'WEBP'}),
+]
+
+
+def photo(size):
+    # a gradient with noise compresses like a photo, a plain color would not
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    with BytesIO() as f:
+        Image.blend(image, noise, 0.3).save(f, 'JPEG', quality=90)
+        return f.getvalue()
+
+
+def main(repeat=3):
+    print('{:>10} {:>12} {:>10} {:>10}'.format('size', 'variant', 'ms', 'kB'))
+    for size in SIZES:
+        data = photo(size)
+        for name, kwargs in VARIANTS:
+            seconds = min(timeit.repeat(lambda: rotate_and_scale_image(data, **kwargs), number=1, repeat=repeat))
+            output = rotate_and_scale_image(data, **kwargs)
+            print('{:>10} {:>12} {:>10.0f} {:>10.0f}'.format('{}x{}'.format(*size), name,
+                                                             seconds * 1000, len(output) / 1024))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,53 @@
+"""
+Peak memory (max RSS of a fresh process) of rotate_and_scale_image for large photos, with the
+default path, the fast path and a pixel budget (image_max_pixels).
+
+    python benchmarks/bench_image_memory.py [megapixels]
+"""
+import json
+import subprocess
+import sys
+import tempfile
+
+VARIANTS = [
+    ('default', {}),
+    ('fast', {'image_fast': True}),
+    ('max_pixels 16MP', {'image_max_pixels': 16 * 1000 * 1000}),
+    ('fast, max_pixels 16MP', {'image_fast': True, 'image_max_pixels': 16 * 1000 * 1000}),
+]
+
+CHILD = '''
+import json, resource, sys
+import PIL.Image
+from postcard_creator.imaging import rotate_and_scale_image
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rotate_and_scale_image(sys.argv[1], **json.loads(sys.argv[2]))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+'''
+
+
+PHOTO = '''
+import sys
+from PIL import Image
+width = int((int(sys.argv[2]) * 1000 * 1000 * 4 / 3) ** 0.5)
+Image.radial_gradient('L').resize((width, width * 3 // 4)).convert('RGB').save(sys.argv[1], 'JPEG')
+'''
+
+
+def photo(path, megapixels):
+    # in another process: the max RSS of a process is inherited by the processes it starts
+    subprocess.check_call([sys.executable, '-c', PHOTO, path, str(megapixels)])
+
+
+def main(megapixels=50):
+    with tempfile.NamedTemporaryFile(suffix='.jpg') as f:
+        photo(f.name, megapixels)
+        print('{} MP jpeg'.format(megapixels))
+        for name, kwargs in VARIANTS:
+            # ru_maxrss is in KB on linux
+            peak = int(subprocess.check_output([sys.executable, '-c', CHILD, f.name, json.dumps(kwargs)]))
+            print('{:>22}: {:>8.1f} MB'.format(name, peak / 1024))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,35 @@
+"""
+Import time of postcard_creator.postcard_creator in a fresh interpreter, compared to
+the heavy dependencies it loads on first use.
+
+    python benchmarks/bench_import.py [repeat]
+"""
+import subprocess
+import sys
+import time
+
+STATEMENTS = [
+    ('postcard_creator', 'import postcard_creator.postcard_creator'),
+    ('+ PIL', 'import postcard_creator.postcard_creator, PIL.Image, resizeimage.resizeimage'),
+    ('+ bs4', 'import postcard_creator.postcard_creator, bs4'),
+    ('+ requests_toolbelt', 'import postcard_creator.postcard_creator, requests_toolbelt'),
+    ('python', 'pass'),
+]
+
+
+def import_time(statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', statement])
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main(repeat=5):
+    for name, statement in STATEMENTS:
+        print('{:>20}: {:>8.1f} ms'.format(name, import_time(statement, repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,32 @@
+"""
+Extraction of the SAMLResponse from the login page: scanner fast path compared to BeautifulSoup.
+
+    python benchmarks/bench_saml.py [number]
+"""
+import os
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+from postcard_creator.postcard_creator import _extract_saml_response
+
+FIXTURE = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'tests', 'saml_response.html')
+
+
+def beautifulsoup(html):
+    return BeautifulSoup(html, 'html.parser').find('input', {'name': 'SAMLResponse'}).get('value')
+
+
+def main(number=2000):
+    with open(FIXTURE) as f:
+        html = f.read()
+    assert _extract_saml_response(html) == beautifulsoup(html)
+
+    for name, func in [('beautifulsoup', beautifulsoup), ('scanner', _extract_saml_response)]:
+        seconds = min(timeit.repeat(lambda: func(html), number=number, repeat=3))
+        print('{:>14}: {:>8.1f} us per page'.format(name, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,115 @@
+"""
+Login, send_free_card end to end, image processing and SVG rendering against the local mock server.
+Reports throughput, p50/p99 latency and peak python memory (tracemalloc, measured in a separate run).
+
+    python benchmarks/bench_suite.py [--cards 200] [--workers 8] [--latency 0.01] [--error-rate 0.02]
+"""
+import argparse
+import concurrent.futures
+import time
+import tracemalloc
+from io import BytesIO
+
+from bench_image import photo
+from mock_server import MockServer
+
+from postcard_creator.imaging import rotate_and_scale_image
+from postcard_creator.postcard_creator import Postcard, PostcardCreator, Recipient, Sender, Token
+from postcard_creator.retry import RetryPolicy
+
+IMAGE_SIZES = [(800, 600), (1600, 1200), (4032, 3024)]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(func, count, workers=1):
+    # returns (seconds, latencies) of count calls of func(i)
+    def timed(i):
+        started = time.perf_counter()
+        func(i)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    if workers == 1:
+        latencies = [timed(i) for i in range(count)]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            latencies = list(executor.map(timed, range(count)))
+    return time.perf_counter() - started, latencies
+
+
+def peak_memory(func, count, workers=1):
+    tracemalloc.start()
+    try:
+        run(func, count, workers)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def report(name, func, count, workers=1, unit='ops'):
+    seconds, latencies = run(func, count, workers)
+    peak = peak_memory(func, max(1, count // 10), workers)
+    print('{:<28} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}  ({}/s)'.format(
+        name, count / seconds, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+        peak / 1024 / 1024, unit))
+
+
+def create_postcard(picture):
+    sender = Sender(prename='prename', lastname='lastname', street='My street 11', place='place', zip_code=8000)
+    recipient = Recipient(prename='prename', lastname='lastname', street='My street 11', place='place',
+                          zip_code=8000)
+    return Postcard(sender=sender, recipient=recipient, picture_stream=BytesIO(picture), message='Coding rocks!')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    picture = photo((1600, 1200))
+    print('{:<28} {:>9} {:>9} {:>9} {:>9}'.format('benchmark', 'rate', 'p50 ms', 'p99 ms', 'peak MB'))
+
+    with MockServer(latency=args.latency, error_rate=args.error_rate, seed=0) as server:
+        def login(i):
+            Token(_protocol=server.protocol).fetch_token('user{}'.format(i), 'password')
+
+        token = Token(_protocol=server.protocol)
+        token.fetch_token('user', 'password')
+        retry_policy = RetryPolicy(backoff=0.01)
+
+        def send(i):
+            pcc = PostcardCreator(token, _protocol=server.protocol, retry_policy=retry_policy)
+            pcc.send_free_card(create_postcard(picture), mock_send=False, image_fast=True)
+
+        def send_pipelined(i):
+            pcc = PostcardCreator(token, _protocol=server.protocol, retry_policy=retry_policy)
+            pcc.send_free_card(create_postcard(picture), pipeline=True, image_fast=True)
+
+        report('fetch_token', login, max(1, args.cards // 4), unit='logins')
+        report('send_free_card', send, args.cards, unit='cards')
+        report('send_free_card x{}'.format(args.workers), send, args.cards, args.workers, unit='cards')
+        report('send_free_card pipelined', send_pipelined, args.cards, unit='cards')
+        print('server: {} requests, {} injected errors, {} orders'.format(server.requests, server.errors,
+                                                                         server.orders))
+
+    for size in IMAGE_SIZES:
+        data = photo(size)
+        label = '{}x{}'.format(*size)
+        report('image {}'.format(label), lambda i: rotate_and_scale_image(data), 10, unit='images')
+        report('image {} fast'.format(label), lambda i: rotate_and_scale_image(data, image_fast=True), 10,
+               unit='images')
+
+    postcard = create_postcard(picture)
+    report('svg pages', lambda i: (postcard.get_frontpage('asset'), postcard.get_backpage()), 5000,
+           unit='cards')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Peak python memory of one asset upload: a multipart body built by requests (files=)
+compared to the MultipartEncoder streamed from a spooled file, as PostcardCreator does.
+
+    python benchmarks/bench_upload_memory.py [size_mb]
+"""
+import os
+import sys
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+from requests_toolbelt import MultipartEncoder
+
+from postcard_creator.postcard_creator import IMAGE_SPOOL_SIZE
+
+
+class DiscardHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def upload_files(url, path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    files = {'title': (None, 'Title of image'), 'asset': ('asset.png', data, 'image/png')}
+    requests.post(url, files=files)
+
+
+def upload_streaming(url, path):
+    with tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE) as spool, open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            spool.write(chunk)
+        spool.seek(0)
+        encoder = MultipartEncoder(fields=[('title', 'Title of image'), ('asset', ('asset.png', spool, 'image/png'))])
+        requests.post(url, data=encoder, headers={'Content-Type': encoder.content_type})
+
+
+def peak(func, *args):
+    tracemalloc.start()
+    func(*args)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_bytes
+
+
+def main(size_mb=8):
+    server = HTTPServer(('127.0.0.1', 0), DiscardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/assets'.format(server.server_port)
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(size_mb * 1024 * 1024))
+    try:
+        for name, func in [('files=', upload_files), ('streaming', upload_streaming)]:
+            print('{:>10}: peak {:>8.1f} MB for a {} MB image'.format(name, peak(func, url, f.name) / 1e6, size_mb))
+    finally:
+        os.remove(f.name)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
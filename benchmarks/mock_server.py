@@ -0,0 +1,161 @@
+"""
+Local stand-in for the Post login and the Postcard Creator REST API, for benchmarks.
+
+Token and PostcardCreator are pointed at it with _protocol=server.protocol,
+'https://postcardcreator.post.ch/...' then becomes 'http://127.0.0.1:<port>/postcardcreator.post.ch/...'.
+
+    with MockServer(latency=0.02, error_rate=0.05) as server:
+        token = Token(_protocol=server.protocol)
+
+latency: seconds every response is delayed
+error_rate: share of REST requests answered with error_status (and Retry-After: 0)
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+USER_ID = 1381204
+
+SAML_PAGE = '<html><body><form method="post">' \
+            '<input type="hidden" name="RelayState" value="pcc"/>' \
+            '<input type="hidden" name="SAMLResponse" value="PHNhbWxwOlJlc3BvbnNlLz4="/>' \
+            '</form></body></html>'
+
+USER = {
+    'tenantId': 'CHE',
+    'userId': USER_ID,
+    'email': 'hi@foo.ch',
+    'givenName': 'Kukka',
+    'familyName': 'Meier',
+    'language': 'en',
+}
+
+REST = '/postcardcreator.post.ch/rest/2.1'
+
+
+class MockServer(object):
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, port=0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self.orders = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._mailings = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def protocol(self):
+        return 'http://127.0.0.1:{}/'.format(self._server.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _count(self, rest):
+        # returns True if the request should fail
+        with self._lock:
+            self.requests += 1
+            if rest and self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def _next_mailing(self):
+        with self._lock:
+            self._mailings += 1
+            return self._mailings
+
+    def _ordered(self):
+        with self._lock:
+            self.orders += 1
+
+    def route(self, method, path):
+        # returns (status, headers, body)
+        path = path.partition('?')[0]
+        if path == '/account.post.ch/SAML/IdentityProvider/':
+            return 200, {}, '' if method == 'GET' else SAML_PAGE
+        if path == '/postcardcreator.post.ch/saml/SSO/alias/defaultAlias':
+            token = {'access_token': uuid.uuid4().hex, 'token_type': 'Bearer', 'expires_in': 3600}
+            return 200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(token)
+        if not path.startswith(REST):
+            return 404, {}, ''
+
+        endpoint = path[len(REST):]
+        location = 'https://postcardcreator.post.ch/rest/2.1/users/{}'.format(USER_ID)
+        if method == 'GET' and endpoint == '/users/current':
+            return 200, {}, json.dumps(USER)
+        if method == 'GET' and re.match(r'^/users/\d+/quota$', endpoint):
+            return 200, {}, json.dumps({'available': True, 'next': None, 'quota': -1, 'retentionDays': 1})
+        if method == 'POST' and re.match(r'^/users/\d+/mailings$', endpoint):
+            return 201, {'Location': '{}/mailings/{}'.format(location, self._next_mailing())}, '{}'
+        if method == 'POST' and re.match(r'^/users/\d+/assets$', endpoint):
+            return 201, {'Location': '{}/assets/user/{}'.format(location, uuid.uuid4())}, ''
+        if method == 'PUT' and re.match(r'^/users/\d+/mailings/\d+/(recipients|pages/[12])$', endpoint):
+            return 204, {}, ''
+        if method == 'POST' and re.match(r'^/users/\d+/mailings/\d+/order$', endpoint):
+            self._ordered()
+            return 200, {}, '{}'
+        return 404, {}, ''
+
+
+def _handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _handle(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+            if server.latency:
+                time.sleep(server.latency)
+
+            if server._count(self.path.startswith(REST)):
+                status, headers, body = server.error_status, {'Retry-After': '0'}, ''
+            else:
+                status, headers, body = server.route(self.command, self.path)
+
+            data = body.encode('utf-8')
+            self.send_response(status)
+            headers.setdefault('Content-Type', 'text/html; charset=utf-8')
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if data:
+                self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = _handle
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == '__main__':
+    import sys
+
+    with MockServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 0) as mock:
+        print('listening, use _protocol={!r}'.format(mock.protocol))
+        while True:
+            time.sleep(3600)
@@ -0,0 +1,114 @@
+"""
+Awaitable wrappers of Token and PostcardCreator.
+
+This is not async I/O: every call runs the blocking requests client on a thread of an executor and
+holds that thread until it returns, a send_free_card for all of its requests and the image scaling.
+At most DEFAULT_MAX_WORKERS (64) calls of all clients without their own executor run at the same time,
+further calls wait for a thread. Pass executor= to raise or partition the limit.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+from postcard_creator.postcard_creator import PostcardCreator, Token
+
+# number of calls (each one or more requests) that may run at the same time for all
+# async clients that do not bring their own executor
+DEFAULT_MAX_WORKERS = 64
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS)
+        return _default_executor
+
+
+class _AsyncClient(object):
+    """
+    Runs the blocking calls of a wrapped client on a shared executor, one thread per call.
+    """
+
+    def __init__(self, client, executor=None):
+        self._client = client
+        self._executor = executor
+
+    def _run(self, func, *args, **kwargs):
+        # only called from coroutines, there is always a running loop
+        loop = asyncio.get_running_loop()
+        executor = self._executor or get_default_executor()
+        return loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    @property
+    def sync(self):
+        return self._client
+
+    def __getattr__(self, name):
+        # data attributes of the wrapped client. its methods may block the event loop, only the
+        # ones wrapped by the subclass are available, the others are reached through .sync
+        value = getattr(self._client, name)
+        if callable(value):
+            raise AttributeError('{} has no async {}(), call .sync.{}() from an executor'.format(
+                type(self).__name__, name, name))
+        return value
+
+
+class AsyncToken(_AsyncClient):
+    def __init__(self, _protocol='https://', executor=None, **kwargs):
+        super(AsyncToken, self).__init__(Token(_protocol=_protocol, **kwargs), executor=executor)
+
+    def is_valid(self, margin=0):
+        # no request, checks the expiry of the fetched token
+        return self._client.is_valid(margin=margin)
+
+    def to_json(self):
+        return self._client.to_json()
+
+    async def fetch_token(self, username, password):
+        return await self._run(self._client.fetch_token, username, password)
+
+    async def has_valid_credentials(self, username, password):
+        return await self._run(self._client.has_valid_credentials, username, password)
+
+
+class AsyncPostcardCreator(_AsyncClient):
+    def __init__(self, token=None, _protocol='https://', executor=None, **kwargs):
+        if isinstance(token, AsyncToken):
+            token = token.sync
+        super(AsyncPostcardCreator, self).__init__(PostcardCreator(token=token, _protocol=_protocol, **kwargs),
+                                                   executor=executor)
+
+    def invalidate_cache(self, key=None):
+        # no request, drops cached user information and quota
+        self._client.invalidate_cache(key)
+
+    async def get_user_info(self):
+        return await self._run(self._client.get_user_info)
+
+    async def get_billing_saldo(self):
+        return await self._run(self._client.get_billing_saldo)
+
+    async def get_quota(self):
+        return await self._run(self._client.get_quota)
+
+    async def has_free_postcard(self):
+        return await self._run(self._client.has_free_postcard)
+
+    async def send_free_card(self, postcard, mock_send=False, **kwargs):
+        return await self._run(self._client.send_free_card, postcard, mock_send=mock_send, **kwargs)
+
+    async def send_mailing(self, sender, recipients, picture_stream, message='', mock_send=False, **kwargs):
+        # the responses of all cards, the blocking generator is consumed on the executor
+        def send():
+            return list(self._client.send_mailing(sender, recipients, picture_stream, message=message,
+                                                  mock_send=mock_send, **kwargs))
+        return await self._run(send)
+
+    async def send_prepared_card(self, card, mock_send=False, before_order=None):
+        return await self._run(self._client.send_prepared_card, card, mock_send=mock_send,
+                               before_order=before_order)
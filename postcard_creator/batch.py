@@ -0,0 +1,116 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+
+from postcard_creator.postcard_creator import PostcardCreator, Token
+
+logger = logging.getLogger('postcard_creator')
+
+# result of one (token, postcard) job. skipped is True if the account had no free postcard left,
+# exception is the exception the job failed with, e.g. a PostcardCreatorException, a requests
+# exception or an error reading the picture
+BatchResult = collections.namedtuple('BatchResult', ['job', 'response', 'exception', 'skipped'])
+
+# result of one login of fetch_tokens. token.idp is the login flow the account uses,
+# exception is the exception the login failed with, e.g. a PostcardCreatorException or a requests exception
+LoginResult = collections.namedtuple('LoginResult', ['username', 'token', 'exception'])
+
+
+class _Account(object):
+    def __init__(self, creator):
+        self.creator = creator
+        self.lock = threading.Lock()
+        self.exhausted = False
+
+
+class _Accounts(object):
+    def __init__(self, creator_kwargs):
+        self._creator_kwargs = creator_kwargs
+        self._accounts = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        # tokens are kept referenced by the account, so their id() is not reused during a batch
+        with self._lock:
+            entry = self._accounts.get(id(token))
+            if entry is None:
+                entry = (token, _Account(PostcardCreator(token=token, **self._creator_kwargs)))
+                self._accounts[id(token)] = entry
+            return entry[1]
+
+
+def _send_job(accounts, job, mock_send, kwargs):
+    token, postcard = job
+    try:
+        account = accounts.get(token)
+        # cards of the same account are sent one after another
+        with account.lock:
+            if account.exhausted or not account.creator.has_free_postcard():
+                account.exhausted = True
+                logger.debug('skipping postcard, no free postcard left for account')
+                return BatchResult(job, None, None, True)
+
+            response = account.creator.send_free_card(postcard, mock_send=mock_send, **kwargs)
+            return BatchResult(job, response, None, False)
+    except Exception as e:
+        # one bad job (unreadable picture, invalid image options...) must not stop the batch
+        logger.debug('sending postcard failed: {!r}'.format(e))
+        return BatchResult(job, None, e, False)
+
+
+def send_batch(jobs, max_workers=4, mock_send=False, creator_kwargs=None, **kwargs):
+    """
+    Send postcards for an iterable of (token, postcard) jobs on a pool of max_workers threads.
+
+    Yields a BatchResult per job as soon as it completes. Jobs are read lazily from the
+    iterable, at most 2 * max_workers are in flight. Accounts without a free postcard are
+    skipped for the rest of the batch. kwargs are passed to send_free_card.
+    """
+    accounts = _Accounts(creator_kwargs or {})
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for job in jobs:
+            pending.add(executor.submit(_send_job, accounts, job, mock_send, kwargs))
+            if len(pending) >= 2 * max_workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+def _login(account, token_kwargs):
+    username, password = account[0], account[1]
+    idp = account[2] if len(account) > 2 else None
+    token = Token(**dict(token_kwargs, idp=idp or token_kwargs.get('idp')))
+    try:
+        token.fetch_token(username, password)
+        return LoginResult(username, token, None)
+    except Exception as e:
+        # one account that can not log in must not stop the others
+        logger.debug('login of {} failed: {!r}'.format(username, e))
+        return LoginResult(username, token, e)
+
+
+def fetch_tokens(accounts, max_workers=4, **token_kwargs):
+    """
+    Log in many accounts on a pool of max_workers threads.
+
+    accounts is an iterable of (username, password) or (username, password, idp) tuples, idp is
+    the login flow the account used before (token.idp), if known. Yields a LoginResult per account
+    as soon as it completes. token_kwargs are passed to Token, e.g. cache= to reuse tokens and
+    the login flows learned before.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for account in accounts:
+            pending.add(executor.submit(_login, account, token_kwargs))
+            if len(pending) >= 2 * max_workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
@@ -0,0 +1,286 @@
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (windows)
+    fcntl = None
+
+# cost of the credential hash. the key is written to disk by FileTokenCache,
+# a plain digest of the password would be too cheap to brute force
+TOKEN_KEY_ITERATIONS = 10000
+
+
+def token_cache_key(username, password, protocol='https://'):
+    salt = '{}{}'.format(protocol, username).encode('utf-8')
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, TOKEN_KEY_ITERATIONS)
+    return digest.hex()
+
+
+class TokenCache(object):
+    """
+    Interface of a token store used by Token.fetch_token.
+
+    Entries are json serializable dicts keyed by token_cache_key().
+    lock(key) must be held while a token is fetched so that only one
+    worker logs in per account.
+    """
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, entry):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def lock(self, key):
+        raise NotImplementedError()
+
+
+class _KeyLocks(object):
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    def get(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+class MemoryTokenCache(TokenCache):
+    def __init__(self):
+        self._entries = {}
+        self._guard = threading.Lock()
+        self._locks = _KeyLocks()
+
+    def get(self, key):
+        with self._guard:
+            entry = self._entries.get(key)
+            return dict(entry) if entry is not None else None
+
+    def set(self, key, entry):
+        with self._guard:
+            self._entries[key] = dict(entry)
+
+    def delete(self, key):
+        with self._guard:
+            self._entries.pop(key, None)
+
+    def lock(self, key):
+        return self._locks.get(key)
+
+
+class FileTokenCache(TokenCache):
+    """
+    Token store in a json file, shared by all processes on a host.
+
+    Writes are atomic (write to temp file, rename). On posix, lock(key) is
+    a flock on a per account lock file so concurrent processes wait for
+    a single login instead of all logging in at once.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'pcc_token_cache.json')
+        self._locks = _KeyLocks()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.pcc_token_cache')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    @contextlib.contextmanager
+    def _file_lock(self, name):
+        with self._locks.get(name):
+            if fcntl is None:
+                yield
+                return
+            with open('{}.{}.lock'.format(self.path, name), 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def get(self, key):
+        return self._read().get(key)
+
+    def set(self, key, entry):
+        with self._file_lock('write'):
+            entries = self._read()
+            entries[key] = entry
+            self._write(entries)
+
+    def delete(self, key):
+        with self._file_lock('write'):
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
+
+    def lock(self, key):
+        return self._file_lock(key[:16])
+
+
+def image_cache_key(data, params):
+    # image_export has no effect on the processed image
+    params = dict((k, v) for k, v in params.items() if k != 'image_export')
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def asset_cache_key(data, user_id):
+    digest = hashlib.sha256(data)
+    digest.update('{}'.format(user_id).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ImageCache(object):
+    """
+    In memory LRU cache of processed images, bounded to max_bytes.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DiskImageCache(object):
+    """
+    LRU cache of processed images in a directory, bounded to max_bytes.
+    Recency is tracked with the modification time of the files.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.size = sum(os.path.getsize(path) for path in self._files())
+
+    def _files(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if not name.startswith('.')]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            path = self._path(key)
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        for path in sorted(self._files(), key=os.path.getmtime):
+            if self.size <= self.max_bytes:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except (IOError, OSError):
+                continue
+            self.size -= size
+
+
+class AssetCache(object):
+    """
+    Remembers the asset id of uploaded images per user for ttl seconds,
+    so the same image is not uploaded again.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, asset_id):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, asset_id)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+import os
+
+from postcard_creator.postcard_creator import Postcard, Recipient
+
+RECIPIENT_FIELDS = ('prename', 'lastname', 'street', 'zip_code', 'place', 'company', 'company_addition',
+                    'salutation')
+
+
+def _recipient(row):
+    return Recipient(**dict((name, row.get(name) or '') for name in RECIPIENT_FIELDS))
+
+
+def _open(source):
+    if hasattr(source, 'read'):
+        return source, False
+    return io.open(source, 'r', encoding='utf-8', newline=''), True
+
+
+def load_recipients(source, format=None):
+    """
+    Yields a Recipient per row of a csv (with a header of RECIPIENT_FIELDS) or jsonl file.
+
+    source is a path or an open text file. Rows are read one at a time, so memory
+    does not grow with the size of the file.
+    """
+    if format is None:
+        name = source if isinstance(source, str) else getattr(source, 'name', '')
+        format = 'jsonl' if os.path.splitext(name)[1].lower() in ('.jsonl', '.ndjson') else 'csv'
+
+    f, close = _open(source)
+    try:
+        if format == 'csv':
+            for row in csv.DictReader(f):
+                yield _recipient(row)
+        elif format == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield _recipient(json.loads(line))
+        else:
+            raise ValueError('unsupported format {}, use csv or jsonl'.format(format))
+    finally:
+        if close:
+            f.close()
+
+
+def iter_postcards(sender, recipients, picture, message=''):
+    # all postcards share the sender and the picture (preferably a path, it is opened per card when sent)
+    for recipient in recipients:
+        yield Postcard(sender=sender, recipient=recipient, picture_stream=picture, message=message)
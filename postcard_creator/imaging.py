@@ -0,0 +1,228 @@
+import collections
+import concurrent.futures
+import logging
+import math
+import os
+from io import BytesIO
+from time import gmtime, strftime
+
+logger = logging.getLogger('postcard_creator')
+
+
+# file name and mime type of the uploaded asset per output format
+IMAGE_FORMATS = {
+    'PNG': ('asset.png', 'image/png'),
+    'JPEG': ('asset.jpg', 'image/jpeg'),
+    'WEBP': ('asset.webp', 'image/webp'),
+}
+
+
+def image_file_type(image_format):
+    try:
+        return IMAGE_FORMATS[image_format.upper()]
+    except KeyError:
+        raise ValueError('unsupported image_format {}, use one of {}'
+                         .format(image_format, ', '.join(sorted(IMAGE_FORMATS))))
+
+
+def rotate_and_scale_image(file, image_target_width=154, image_target_height=111,
+                           image_quality_factor=20, image_rotate=True, image_export=False,
+                           image_fast=False, image_format='PNG', image_quality=90, image_max_pixels=None,
+                           out=None):
+    # returns the encoded image as bytes or, if out is given, writes it to the file object out
+    # and returns out rewound to the start.
+    # with image_max_pixels, jpegs are decoded at the smallest scale that covers the target and images
+    # still larger than image_max_pixels are refused before they are decoded
+    # PIL is imported on first use, importing postcard_creator stays cheap for clients without images
+    from PIL import Image
+
+    if isinstance(file, (bytes, bytearray)):
+        file = BytesIO(file)
+    image_format = image_format.upper()
+    image_file_type(image_format)
+
+    with Image.open(file) as image:
+        if image_max_pixels is not None:
+            _limit_pixels(image, image_target_width, image_target_height, image_quality_factor,
+                          image_rotate, image_max_pixels)
+        if image_fast:
+            cover = _fast_cover(image, image_target_width, image_target_height,
+                                image_quality_factor, image_rotate)
+        else:
+            cover = _cover(image, image_target_width, image_target_height,
+                           image_quality_factor, image_rotate)
+
+        if out is None:
+            with BytesIO() as f:
+                _save(cover, f, image_format, image_quality)
+                scaled = f.getvalue()
+        else:
+            _save(cover, out, image_format, image_quality)
+            out.seek(0)
+            scaled = out
+
+        if image_export:
+            name = strftime("postcard_creator_export_%Y-%m-%d_%H-%M-%S.jpg", gmtime())
+            path = os.path.join(os.getcwd(), name)
+            logger.info('exporting image to {} (image_export=True)'.format(path))
+            cover.save(path)
+
+    return scaled
+
+
+def _quality_factor(width, height, image_target_width, image_target_height, image_quality_factor):
+    if width < image_quality_factor * image_target_width \
+            or height < image_quality_factor * image_target_height:
+        factor_width = math.floor(width / image_target_width)
+        factor_height = math.floor(height / image_target_height)
+        factor = min([factor_height, factor_width])
+
+        logger.debug('image is smaller than default for resize/fill. '
+                     'using scale factor {} instead of {}'.format(factor, image_quality_factor))
+        return factor
+    return image_quality_factor
+
+
+def _target_size(image, image_target_width, image_target_height, image_quality_factor, image_rotate):
+    # size of the scaled image in the orientation of image, and whether it is rotated
+    rotate = image_rotate and image.width < image.height
+    width, height = (image.height, image.width) if rotate else image.size
+
+    image_quality_factor = _quality_factor(width, height, image_target_width,
+                                           image_target_height, image_quality_factor)
+    if image_quality_factor < 1:
+        raise ValueError('image of {}x{} is smaller than {}x{}'
+                         .format(width, height, image_target_width, image_target_height))
+
+    target = (image_target_width * image_quality_factor, image_target_height * image_quality_factor)
+    if rotate:
+        target = (target[1], target[0])
+    return target, rotate
+
+
+def _limit_pixels(image, image_target_width, image_target_height, image_quality_factor, image_rotate,
+                  image_max_pixels):
+    # only the header was read so far, the image is not decoded yet
+    if image.width * image.height > image_max_pixels and image.format == 'JPEG':
+        target, _ = _target_size(image, image_target_width, image_target_height, image_quality_factor,
+                                 image_rotate)
+        image.draft(None, target)
+    pixels = image.width * image.height
+    if pixels > image_max_pixels:
+        raise ValueError('image of {}x{} ({} format) has more than {} pixels'
+                         .format(image.width, image.height, image.format, image_max_pixels))
+    logger.debug('decoding image at {}x{}, about {:.1f} MB'
+                 .format(image.width, image.height, pixels * len(image.getbands()) / 1024 / 1024))
+
+
+def _cover(image, image_target_width, image_target_height, image_quality_factor, image_rotate):
+    from resizeimage import resizeimage
+
+    if image_rotate and image.width < image.height:
+        image = image.rotate(90, expand=True)
+        logger.debug('rotating image by 90 degrees')
+
+    image_quality_factor = _quality_factor(image.width, image.height, image_target_width,
+                                           image_target_height, image_quality_factor)
+    width = image_target_width * image_quality_factor
+    height = image_target_height * image_quality_factor
+    logger.debug('resizing image from {}x{} to {}x{}'
+                 .format(image.width, image.height, width, height))
+
+    return resizeimage.resize_cover(image, [width, height], validate=True)
+
+
+def _fast_cover(image, image_target_width, image_target_height, image_quality_factor, image_rotate):
+    # same result as _cover, but the image is decoded at the smallest scale that still covers
+    # the target (jpeg draft mode), cropped and resized in one pass and transposed at the end,
+    # when it is small.
+    from PIL import Image
+
+    width, height = image.size
+    target, rotate = _target_size(image, image_target_width, image_target_height, image_quality_factor,
+                                  image_rotate)
+
+    if image.format == 'JPEG':
+        image.draft(None, target)
+    logger.debug('resizing image from {}x{} (decoded at {}x{}) to {}x{}'
+                 .format(width, height, image.width, image.height, *target))
+
+    cover = image.resize(target, Image.LANCZOS, box=_cover_box(image.size, target), reducing_gap=3.0)
+    if rotate:
+        cover = cover.transpose(Image.ROTATE_90)
+        logger.debug('rotating image by 90 degrees')
+    return cover
+
+
+def _cover_box(size, target):
+    # centered region of an image of size with the aspect ratio of target
+    ratio = max(target[0] / size[0], target[1] / size[1])
+    width = target[0] / ratio
+    height = target[1] / ratio
+    left = max((size[0] - width) / 2, 0)
+    top = max((size[1] - height) / 2, 0)
+    return left, top, min(left + width, size[0]), min(top + height, size[1])
+
+
+def _save(image, f, image_format, image_quality):
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if image_format == 'PNG':
+        image.save(f, image_format)
+    else:
+        image.save(f, image_format, quality=image_quality)
+
+
+def read_picture(file):
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if hasattr(file, 'read'):
+        return file.read()
+    with open(file, 'rb') as f:
+        return f.read()
+
+
+def _picture_source(file):
+    # open files cannot be sent to another process, read them in the caller
+    if hasattr(file, 'read'):
+        return file.read()
+    return file
+
+
+class ImageProcessor(object):
+    """
+    Scales postcard images on a pool of worker processes.
+
+    Pass it to PostcardCreator(image_processor=...) or use it on its own.
+    Accepts file objects, paths and bytes like rotate_and_scale_image.
+    """
+
+    def __init__(self, max_workers=None, executor=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = executor or concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, file, **kwargs):
+        return self._executor.submit(rotate_and_scale_image, _picture_source(file), **kwargs)
+
+    def process(self, file, **kwargs):
+        return self.submit(file, **kwargs).result()
+
+    def map(self, files, window=None, **kwargs):
+        # yields the scaled images in order. files are read lazily, at most window images are in flight
+        window = window or 2 * self.max_workers
+        pending = collections.deque()
+        for file in files:
+            pending.append(self.submit(file, **kwargs))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
@@ -0,0 +1,131 @@
+import bisect
+import collections
+import logging
+import re
+import threading
+
+logger = logging.getLogger('postcard_creator')
+
+# upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_ID_SEGMENT = re.compile(r'/(?:[0-9]+|[0-9a-fA-F-]{16,})(?=/|$)')
+
+# what was measured, passed to hooks and recorded by Instrumentation. kinds are
+#   request: name is the endpoint, status the http status code or 'error'
+#   login: name is the step ('post', 'swissid', 'sso'), status 'ok' or 'error'
+#   image: status 'ok' or 'error', bytes_received is the size of the processed image
+#   cache: name is the cache ('user', 'quota', 'image', 'asset'), status 'hit' or 'miss', no duration
+#   quota: name is the user id, status 'available' or 'exhausted', no duration
+Event = collections.namedtuple('Event', ['kind', 'name', 'duration', 'status', 'bytes_sent', 'bytes_received'])
+
+
+def endpoint_name(method, endpoint):
+    # '/users/1381204/mailings/28661786/order' -> 'POST /users/{id}/mailings/{id}/order'
+    return '{} {}'.format(method.upper(), _ID_SEGMENT.sub('/{id}', endpoint))
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is for values larger than all buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # upper bound of the bucket containing the q-quantile
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class _Stats(object):
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class Instrumentation(object):
+    """
+    Collects timings of requests, logins and image processing.
+
+    Disabled by default. Nothing is measured unless it is enabled or a hook is registered,
+    so the instrumented code only pays for a single attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._hooks = []
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.enabled or bool(self._hooks)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add_hook(self, hook):
+        # hook(event) is called for every measurement, event is an Event
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    def record(self, kind, name, duration, status=None, bytes_sent=0, bytes_received=0):
+        event = Event(kind, name, duration, status, bytes_sent, bytes_received)
+        if self.enabled:
+            with self._lock:
+                stats = self._stats.get((kind, name))
+                if stats is None:
+                    stats = self._stats[(kind, name)] = _Stats()
+                stats.latency.observe(duration)
+                stats.statuses[status] += 1
+                stats.bytes_sent += bytes_sent
+                stats.bytes_received += bytes_received
+
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception('instrumentation hook failed')
+
+    def snapshot(self):
+        with self._lock:
+            return dict(((kind, name), {
+                'count': stats.latency.count,
+                'seconds': stats.latency.sum,
+                'p50': stats.latency.quantile(0.5),
+                'p99': stats.latency.quantile(0.99),
+                'buckets': list(zip(stats.latency.buckets, stats.latency.counts)),
+                'statuses': dict(stats.statuses),
+                'bytes_sent': stats.bytes_sent,
+                'bytes_received': stats.bytes_received,
+            }) for (kind, name), stats in self._stats.items())
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+instrumentation = Instrumentation()
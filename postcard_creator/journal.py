@@ -0,0 +1,62 @@
+import sqlite3
+import time
+
+_COLUMNS = ['user_id', 'card_id', 'asset_id', 'recipient_set', 'pages_set', 'order_started', 'ordered']
+
+
+class SendJournal(object):
+    """
+    Durable record of the completed steps of send_free_card per idempotency key, in a sqlite file.
+
+    A send that failed or crashed is resumed from the last completed step when it is
+    retried with the same key. A card is never ordered twice for a key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS sends ('
+                       'key TEXT PRIMARY KEY, user_id TEXT, card_id TEXT, asset_id TEXT, '
+                       'recipient_set INTEGER DEFAULT 0, pages_set INTEGER DEFAULT 0, '
+                       'order_started INTEGER DEFAULT 0, ordered INTEGER DEFAULT 0, updated_at REAL)')
+
+    def _connect(self):
+        # one short lived connection per operation, safe to use from many threads and processes
+        return _Connection(sqlite3.connect(self.path, timeout=30))
+
+    def get(self, key):
+        with self._connect() as db:
+            row = db.execute('SELECT {} FROM sends WHERE key = ?'.format(', '.join(_COLUMNS)), (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(_COLUMNS, row))
+
+    def update(self, key, **fields):
+        unknown = set(fields) - set(_COLUMNS)
+        if unknown:
+            raise ValueError('unknown journal fields: {}'.format(', '.join(sorted(unknown))))
+        assignments = ', '.join('{} = ?'.format(name) for name in fields)
+        with self._connect() as db:
+            db.execute('INSERT OR IGNORE INTO sends (key) VALUES (?)', (key,))
+            db.execute('UPDATE sends SET {}, updated_at = ? WHERE key = ?'.format(assignments),
+                       list(fields.values()) + [time.time(), key])
+
+    def delete(self, key):
+        with self._connect() as db:
+            db.execute('DELETE FROM sends WHERE key = ?', (key,))
+
+
+class _Connection(object):
+    # commits on success and always closes, unlike sqlite3.Connection as context manager
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        return self._connection
+
+    def __exit__(self, exc_type, *args):
+        try:
+            if exc_type is None:
+                self._connection.commit()
+        finally:
+            self._connection.close()
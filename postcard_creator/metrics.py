@@ -0,0 +1,179 @@
+import collections
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from postcard_creator.instrumentation import DEFAULT_BUCKETS, Histogram, instrumentation
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# upper bounds in bytes of the processed image sizes
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+# name: (type, help). counters are exposed with a _total suffix
+FAMILIES = collections.OrderedDict([
+    ('pcc_logins', ('counter', 'Logins by login flow and outcome')),
+    ('pcc_login_duration_seconds', ('histogram', 'Duration of the login steps')),
+    ('pcc_requests', ('counter', 'Requests to the Postcard Creator API by endpoint and status')),
+    ('pcc_request_duration_seconds', ('histogram', 'Latency of requests to the Postcard Creator API')),
+    ('pcc_request_sent_bytes', ('counter', 'Bytes sent in request bodies')),
+    ('pcc_request_received_bytes', ('counter', 'Bytes received in response bodies')),
+    ('pcc_image_duration_seconds', ('histogram', 'Duration of image scaling')),
+    ('pcc_image_size_bytes', ('histogram', 'Size of the processed images')),
+    ('pcc_cache_lookups', ('counter', 'Cache lookups by cache and result')),
+    ('pcc_quota_available', ('gauge', '1 if the account had a free postcard at the last quota check')),
+])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Metrics(object):
+    """
+    Counters, gauges and histograms of the instrumentation events in the OpenMetrics text format.
+
+    install() registers it as a hook of postcard_creator.instrumentation.instrumentation,
+    generate() returns the exposition, serve() starts a local http exporter.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, size_buckets=SIZE_BUCKETS):
+        self.buckets = buckets
+        self.size_buckets = size_buckets
+        self._values = collections.defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def install(self, source=instrumentation):
+        source.add_hook(self.observe)
+        return self
+
+    def uninstall(self, source=instrumentation):
+        source.remove_hook(self.observe)
+
+    def _inc(self, name, labels, value=1):
+        values = self._values[name]
+        values[labels] = values.get(labels, 0) + value
+
+    def _observe(self, name, labels, value, buckets=None):
+        values = self._values[name]
+        histogram = values.get(labels)
+        if histogram is None:
+            histogram = values[labels] = Histogram(buckets or self.buckets)
+        histogram.observe(value)
+
+    def observe(self, event):
+        with self._lock:
+            if event.kind == 'request':
+                labels = (('endpoint', event.name),)
+                self._inc('pcc_requests', labels + (('status', event.status),))
+                self._observe('pcc_request_duration_seconds', labels, event.duration)
+                self._inc('pcc_request_sent_bytes', labels, event.bytes_sent)
+                self._inc('pcc_request_received_bytes', labels, event.bytes_received)
+            elif event.kind == 'login':
+                if event.name != 'sso':
+                    self._inc('pcc_logins', (('idp', event.name), ('outcome', event.status)))
+                self._observe('pcc_login_duration_seconds', (('step', event.name),), event.duration)
+            elif event.kind == 'image':
+                self._observe('pcc_image_duration_seconds', (('outcome', event.status),), event.duration)
+                if event.status == 'ok':
+                    self._observe('pcc_image_size_bytes', (), event.bytes_received, self.size_buckets)
+            elif event.kind == 'cache':
+                self._inc('pcc_cache_lookups', (('cache', event.name), ('result', event.status)))
+            elif event.kind == 'quota':
+                self._values['pcc_quota_available'][(('user_id', event.name),)] = \
+                    1 if event.status == 'available' else 0
+
+    def generate(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in FAMILIES.items():
+                values = self._values.get(name)
+                if not values:
+                    continue
+                lines.append('# TYPE {} {}'.format(name, kind))
+                lines.append('# HELP {} {}'.format(name, help_text))
+                for labels, value in sorted(values.items(), key=lambda item: str(item[0])):
+                    if kind == 'counter':
+                        lines.append('{}_total{} {}'.format(name, _labels(labels), _number(value)))
+                    elif kind == 'gauge':
+                        lines.append('{}{} {}'.format(name, _labels(labels), _number(value)))
+                    else:
+                        lines.extend(self._histogram_lines(name, labels, value))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def _histogram_lines(self, name, labels, histogram):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+            cumulative += count
+            le = '+Inf' if bound == math.inf else repr(float(bound))
+            lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', le),)), cumulative))
+        lines.append('{}_count{} {}'.format(name, _labels(labels), histogram.count))
+        lines.append('{}_sum{} {}'.format(name, _labels(labels), _number(float(histogram.sum))))
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def serve(self, port=9464, host='127.0.0.1'):
+        # exports generate() on every path, returns the running MetricsServer
+        return MetricsServer(self, port=port, host=host).start()
+
+
+class MetricsServer(object):
+    def __init__(self, metrics, port=9464, host='127.0.0.1'):
+        self.metrics = metrics
+        self._server = ThreadingHTTPServer((host, port), _handler(metrics))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def _handler(metrics):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = metrics.generate().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
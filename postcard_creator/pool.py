@@ -0,0 +1,226 @@
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import logging
+import re
+import threading
+import time
+
+import requests
+
+from postcard_creator.postcard_creator import PostcardCreator, PostcardCreatorException
+
+logger = logging.getLogger('postcard_creator')
+
+# an exhausted account whose quota has no readable 'next' is asked again after this many seconds
+DEFAULT_RESET_SECONDS = 24 * 60 * 60
+# an exhausted account is not asked again before this many seconds, even if its 'next' has passed
+# already (clock skew, a date without time, a stale value)
+MIN_BACKOFF_SECONDS = 5 * 60
+
+
+def parse_quota_next(value):
+    # 'next' of get_quota() as an aware datetime, a date is taken as midnight utc.
+    # None if it can not be parsed
+    if not value:
+        return None
+    text = re.sub(r'([+-]\d\d):?(\d\d)$', r'\1:\2', value.strip().replace('Z', '+00:00'))
+    try:
+        parsed = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        try:
+            parsed = datetime.datetime.strptime(text[:10], '%Y-%m-%d')
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class _PoolAccount(object):
+    def __init__(self, token, creator):
+        self.token = token
+        self.creator = creator
+        self.busy = False
+        # None while the quota is unknown or available, else the time the quota resets
+        self.exhausted_until = None
+
+
+class AccountPool(object):
+    """
+    Sends postcards from many accounts, one card per account at a time.
+
+    The quota of every account is remembered with the time it resets ('next' of get_quota),
+    accounts without a free postcard are not asked again before then. When all accounts that
+    may have quota are busy, callers wait until one is released.
+    """
+
+    def __init__(self, tokens=(), creator_kwargs=None, default_reset=DEFAULT_RESET_SECONDS,
+                 min_backoff=MIN_BACKOFF_SECONDS, clock=_utcnow):
+        self.creator_kwargs = creator_kwargs or {}
+        self.default_reset = default_reset
+        self.min_backoff = min_backoff
+        self._clock = clock
+        self._accounts = collections.deque()
+        self._lock = threading.Lock()
+        # notified when an account is released
+        self._released = threading.Condition(self._lock)
+        for token in tokens:
+            self.add(token)
+
+    def add(self, token):
+        account = _PoolAccount(token, PostcardCreator(token=token, **self.creator_kwargs))
+        with self._lock:
+            self._accounts.append(account)
+        return account.creator
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def _take(self, now):
+        # next idle account that may have quota, the pool is rotated so accounts take turns.
+        # called with the lock held
+        for _ in range(len(self._accounts)):
+            account = self._accounts[0]
+            self._accounts.rotate(-1)
+            if account.busy:
+                continue
+            if account.exhausted_until is not None:
+                if account.exhausted_until > now:
+                    continue
+                account.exhausted_until = None
+                account.creator.invalidate_cache('quota')
+            account.busy = True
+            return account
+        return None
+
+    def _busy(self):
+        # called with the lock held
+        return any(account.busy for account in self._accounts)
+
+    def _release(self, account):
+        with self._released:
+            account.busy = False
+            self._released.notify_all()
+
+    def _check_quota(self, account, now):
+        # returns True if the account has a free postcard, else remembers when it resets
+        quota = account.creator.get_quota()
+        if quota['available']:
+            return True
+        reset = parse_quota_next(quota.get('next'))
+        if reset is None:
+            reset = now + datetime.timedelta(seconds=self.default_reset)
+        reset = max(reset, now + datetime.timedelta(seconds=self.min_backoff))
+        logger.debug('no free postcard left for account, skipping it until {}'.format(reset.isoformat()))
+        with self._lock:
+            account.exhausted_until = reset
+        return False
+
+    def acquire(self, timeout=None):
+        # returns an idle account with a free postcard, it is busy until release(). while all accounts
+        # that may have quota are busy, waits up to timeout seconds (forever if None) for one to be
+        # released. None if no account has quota or on timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = self._clock()
+            with self._released:
+                account = self._take(now)
+                while account is None and self._busy():
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._released.wait(remaining)
+                    now = self._clock()
+                    account = self._take(now)
+                if account is None:
+                    return None
+            try:
+                available = self._check_quota(account, now)
+            except BaseException:
+                self._release(account)
+                raise
+            if available:
+                return account
+            self._release(account)
+
+    def release(self, account):
+        self._release(account)
+
+    @contextlib.contextmanager
+    def account(self, timeout=None):
+        """
+        Context manager yielding the PostcardCreator of an account with a free postcard.
+        Waits while all accounts that may have one are busy, raises PostcardCreatorException
+        if no account has one or if none was released within timeout seconds.
+        """
+        account = self.acquire(timeout=timeout)
+        if account is None:
+            with self._lock:
+                busy = self._busy()
+            if busy:
+                raise PostcardCreatorException('All accounts are busy, none was released within {} seconds'
+                                               .format(timeout))
+            next_available = self.next_available()
+            raise PostcardCreatorException('No account with a free postcard left. Try again at {}'.format(
+                next_available.isoformat() if next_available is not None else 'never, the pool is empty'))
+        try:
+            yield account.creator
+        finally:
+            self.release(account)
+
+    def send_free_card(self, postcard, mock_send=False, **kwargs):
+        with self.account() as creator:
+            return creator.send_free_card(postcard, mock_send=mock_send, **kwargs)
+
+    def send_prepared_card(self, card, mock_send=False, before_order=None):
+        with self.account() as creator:
+            return creator.send_prepared_card(card, mock_send=mock_send, before_order=before_order)
+
+    def refresh(self, max_workers=4):
+        # fetches the quota of idle accounts that are not known to be exhausted, so capacity() is exact
+        now = self._clock()
+        with self._lock:
+            accounts = [a for a in self._accounts if not a.busy and
+                        (a.exhausted_until is None or a.exhausted_until <= now)]
+            for account in accounts:
+                if account.exhausted_until is not None:
+                    account.exhausted_until = None
+                    account.creator.invalidate_cache('quota')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._check_quota, account, now) for account in accounts]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except (PostcardCreatorException, requests.RequestException) as e:
+                    logger.debug('fetching quota failed: {}'.format(e))
+
+    def capacity(self, at=None):
+        # number of accounts that may send a card at time at (now by default). accounts whose
+        # quota was not fetched yet are counted, see refresh()
+        at = at or self._clock()
+        with self._lock:
+            return sum(1 for a in self._accounts if a.exhausted_until is None or a.exhausted_until <= at)
+
+    def next_available(self):
+        # earliest time an account may send a card, now if one may send already, None for an empty pool
+        now = self._clock()
+        with self._lock:
+            if not self._accounts:
+                return None
+            return max(now, min(a.exhausted_until or now for a in self._accounts))
+
+    def schedule(self):
+        # sorted list of (time, number of accounts that become available), the first entry
+        # holds the accounts available now
+        now = self._clock()
+        counts = collections.Counter()
+        with self._lock:
+            for account in self._accounts:
+                counts[max(now, account.exhausted_until or now)] += 1
+        return sorted(counts.items())
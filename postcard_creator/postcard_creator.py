@@ -1,17 +1,28 @@
+import concurrent.futures
+import copy
+import functools
 import logging
-import requests
 import json
-from bs4 import BeautifulSoup
-from requests_toolbelt.utils import dump
+import requests
 import datetime
-from PIL import Image
-from io import BytesIO
-from resizeimage import resizeimage
-import pkg_resources
-import math
-import os
-from time import gmtime, strftime
 import re
+import tempfile
+import threading
+import time
+import uuid
+from html import unescape
+from io import BytesIO
+from urllib.parse import urlparse
+
+from postcard_creator.cache import asset_cache_key, image_cache_key, token_cache_key
+from postcard_creator.instrumentation import endpoint_name, instrumentation
+from postcard_creator.imaging import image_file_type, read_picture, rotate_and_scale_image
+from postcard_creator.retry import default_retry_policy, get_rate_limiter
+from postcard_creator.templates import SvgTemplate, backpage_template, backpage_values, frontpage_template
+from postcard_creator.transport import get_default_transport
+
+# scaled images are encoded into memory up to this size, larger ones are spooled to a temporary file
+IMAGE_SPOOL_SIZE = 1024 * 1024
 
 LOGGING_TRACE_LVL = 5
 logger = logging.getLogger('postcard_creator')
@@ -19,22 +30,168 @@ logging.addLevelName(LOGGING_TRACE_LVL, 'TRACE')
 setattr(logger, 'trace', lambda *args: logger.log(LOGGING_TRACE_LVL, *args))
 
 
+# request and response bodies are cut to this many bytes in trace logs
+TRACE_BODY_LIMIT = 2048
+
+
 def _trace_request(response):
-    data = dump.dump_all(response)
+    if not logger.isEnabledFor(LOGGING_TRACE_LVL):
+        return
+    request = response.request
+    lines = ['< {} {}'.format(request.method, request.url)]
+    lines += ['< {}: {}'.format(k, v) for k, v in request.headers.items()]
+    lines += ['<', _format_body(request.body), '']
+    lines += ['> {} {}'.format(response.status_code, response.reason)]
+    lines += ['> {}: {}'.format(k, v) for k, v in response.headers.items()]
+    lines += ['>', _format_body(response.content)]
+    logger.trace('\n'.join(lines))
+
+
+def _format_body(body):
+    if body is None:
+        return ''
+    if isinstance(body, str):
+        body = body.encode('utf-8', 'replace')
+    if not isinstance(body, bytes):
+        return '<streamed body of {} bytes>'.format(_body_size(body))
+    text = body[:TRACE_BODY_LIMIT].decode('utf-8', 'replace')
+    if len(body) > TRACE_BODY_LIMIT:
+        text += '... ({} more bytes)'.format(len(body) - TRACE_BODY_LIMIT)
+    return text
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    # MultipartEncoder
+    return getattr(body, 'len', 0)
+
+
+def _measure(kind, name, func, *args, _size=None, **kwargs):
+    # _size(result) is recorded as bytes_received, e.g. the size of a processed image
+    if not instrumentation.active:
+        return func(*args, **kwargs)
+    started = time.perf_counter()
+    status = 'error'
+    size = 0
     try:
-        logger.trace(data.decode())
-    except Exception:
-        data = str(data).replace('\\r\\n', '\r\n')
-        logger.trace(data)
+        result = func(*args, **kwargs)
+        status = 'ok'
+        if _size is not None:
+            size = _size(result)
+        return result
+    finally:
+        instrumentation.record(kind, name, time.perf_counter() - started, status=status, bytes_received=size)
+
+
+def _count_cache(name, hit):
+    if instrumentation.active:
+        instrumentation.record('cache', name, 0.0, status='hit' if hit else 'miss')
+
+
+def _picture_size(picture):
+    if isinstance(picture, (bytes, bytearray)):
+        return len(picture)
+    size = picture.seek(0, 2)
+    picture.seek(0)
+    return size
+
+
+# start tag name and attributes, the same rules as html.parser (which BeautifulSoup uses)
+_TAG_NAME = re.compile(r'([a-zA-Z][^\t\n\r\f />\x00]*)(?:\s|/(?!>))*')
+_ATTRIBUTE = re.compile(r'((?<=[\'"\s/])[^\s/>][^\s/=>]*)'
+                        r'(\s*=+\s*(\'[^\']*\'|"[^"]*"|(?![\'"])[^>\s]*))?(?:\s|/(?!>))*')
+_TAG_END = re.compile(r'/?>')
+# elements whose content is text, not markup
+_RAW_TEXT_END = {name: re.compile(r'</{}'.format(name), re.I) for name in ('script', 'style')}
+
+
+def _tag_attributes(html, pos):
+    # attributes of the start tag whose name ends at pos, in order, and the position after the tag.
+    # None if the tag is not closed
+    attributes = {}
+    while True:
+        match = _ATTRIBUTE.match(html, pos)
+        if match is None or match.end() == pos:
+            break
+        name, assignment, value = match.groups()
+        if not assignment:
+            value = ''
+        elif value[:1] == value[-1:] and value[:1] in ('"', "'") and len(value) > 1:
+            value = value[1:-1]
+        # the last of duplicate attributes wins, as in BeautifulSoup
+        attributes[name.lower()] = unescape(value) if value else ''
+        pos = match.end()
+    end = _TAG_END.match(html, pos)
+    return (attributes, end.end()) if end is not None else (None, pos)
+
+
+def _scan_saml_response(html):
+    # value of the first <input name="SAMLResponse">, skipping comments and script and style text.
+    # None if there is none or the page has markup the scanner does not handle
+    pos = 0
+    while True:
+        pos = html.find('<', pos)
+        if pos < 0:
+            return None
+        if html.startswith('<!--', pos):
+            end = html.find('-->', pos + 4)
+            if end < 0:
+                return None
+            pos = end + 3
+            continue
+        tag = _TAG_NAME.match(html, pos + 1)
+        if tag is None:
+            if html.startswith('<![', pos) or html.startswith('</', pos) and not html[pos + 2:pos + 3].isalpha():
+                return None
+            if html.startswith(('</', '<!', '<?'), pos):
+                pos = html.find('>', pos)
+                if pos < 0:
+                    return None
+            pos += 1
+            continue
+
+        name = tag.group(1).lower()
+        attributes, pos = _tag_attributes(html, tag.end())
+        if attributes is None:
+            return None
+        if name == 'input' and attributes.get('name') == 'SAMLResponse':
+            return attributes.get('value')
+        if name in _RAW_TEXT_END:
+            end = _RAW_TEXT_END[name].search(html, pos)
+            if end is None:
+                return None
+            pos = end.start()
+
+
+def _extract_saml_response(html):
+    # the login pages are small and regular, a scanner finds the SAMLResponse input without building
+    # a document tree. if it finds no value, fall back to BeautifulSoup
+    value = _scan_saml_response(html)
+    if value is not None:
+        return value
+
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    saml_response = soup.find('input', {'name': 'SAMLResponse'})
+    return saml_response.get('value') if saml_response is not None else None
 
 
 class PostcardCreatorException(Exception):
     server_response = None
 
 
+# identity providers of Token._login, the name of the login flow an account uses
+IDP_POST = 'post'
+IDP_SWISSID = 'swissid'
+
+
 class Token(object):
-    def __init__(self, _protocol='https://'):
+    def __init__(self, _protocol='https://', cache=None, refresh_margin=300, transport=None, idp=None):
         self.protocol = _protocol
+        self.transport = transport
         self.base = '{}account.post.ch'.format(self.protocol)
         self.swissid = '{}login.swissid.ch'.format(self.protocol)
         self.token_url = '{}postcardcreator.post.ch/saml/SSO/alias/defaultAlias'.format(self.protocol)
@@ -44,16 +201,22 @@ class Token(object):
             'Origin': '{}account.post.ch'.format(self.protocol)
         }
 
-        # cache_filename = 'pcc_cache.json'
-
         self.token = None
         self.token_type = None
         self.token_expires_in = None
         self.token_fetched_at = None
-        self.cache_token = False
+
+        # optional postcard_creator.cache.TokenCache shared between instances/ processes.
+        # cached tokens are refreshed refresh_margin seconds before they expire
+        self.cache = cache
+        self.refresh_margin = refresh_margin
+
+        # login flow the account used last time (IDP_POST or IDP_SWISSID), tried first on the next login.
+        # learned on login and kept in the token cache entry
+        self.idp = idp
 
     def _create_session(self):
-        return requests.Session()
+        return (self.transport or get_default_transport()).create_session()
 
     def has_valid_credentials(self, username, password):
         try:
@@ -62,21 +225,11 @@ class Token(object):
         except PostcardCreatorException:
             return False
 
-    # def store_token_to_cache(self, key, token):
-    #
-    # def check_token_in_cache(self, username, password):
-    #     tmp_dir = tempfile.gettempdir()
-    #     tmp_path = os.path.join(tmp_dir, self.cache_filename)
-    #     tmp_file = Path(tmp_path)
-    #
-    #     if tmp_file.exists():
-    #         cache_content = open(tmp_file, "r").read()
-    #         cache = []
-    #         try:
-    #             cache = json.load(cache_content)
-    #         except Exception:
-    #             return None
-    #
+    def is_valid(self, margin=0):
+        if self.token is None or self.token_fetched_at is None or self.token_expires_in is None:
+            return False
+        expires_at = self.token_fetched_at + datetime.timedelta(seconds=int(self.token_expires_in))
+        return datetime.datetime.now() + datetime.timedelta(seconds=margin) < expires_at
 
     def fetch_token(self, username, password):
         logger.debug('fetching postcard account token')
@@ -84,19 +237,86 @@ class Token(object):
         if username is None or password is None:
             raise PostcardCreatorException('No username/ password given')
 
-        # if self.cache_token:
-        #     self.check_token_in_cache(username, password)
+        if self.cache is None:
+            return self._login(username, password)
+
+        key = token_cache_key(username, password, self.protocol)
+        if self._load_cached_token(key):
+            logger.debug('using cached postcard account token')
+            return
+
+        with self.cache.lock(key):
+            # another worker may have logged in while we were waiting for the lock
+            if self._load_cached_token(key):
+                logger.debug('using cached postcard account token')
+                return
+            self._login(username, password)
+            self.cache.set(key, self._to_cache_entry())
+
+    def _load_cached_token(self, key):
+        entry = self.cache.get(key)
+        if not entry:
+            return False
+        # expired entries still tell which login flow the account uses
+        self.idp = entry.get('idp') or self.idp
+        if entry.get('token') is None:
+            return False
+
+        fetched_at = datetime.datetime.fromtimestamp(entry['fetched_at'])
+        expires_at = fetched_at + datetime.timedelta(seconds=int(entry['expires_in']))
+        if datetime.datetime.now() + datetime.timedelta(seconds=self.refresh_margin) >= expires_at:
+            logger.debug('cached postcard account token expires soon, refreshing')
+            return False
+
+        self.token = entry['token']
+        self.token_type = entry['token_type']
+        self.token_expires_in = entry['expires_in']
+        self.token_fetched_at = fetched_at
+        return True
+
+    def _to_cache_entry(self):
+        return {
+            'token': self.token,
+            'token_type': self.token_type,
+            'expires_in': self.token_expires_in,
+            'fetched_at': self.token_fetched_at.timestamp(),
+            'idp': self.idp,
+        }
+
+    def _login(self, username, password):
+        # authenticate with the login flow the account used last time, Post account if unknown.
+        # if it fails, try the other one
+        first = self.idp if self.idp in (IDP_POST, IDP_SWISSID) else IDP_POST
+        second = IDP_SWISSID if first == IDP_POST else IDP_POST
 
-        # try first to authenticate with Post account, if it fails, try SwissID
-        session = None
-        saml_response = None
+        idp = first
         try:
-            session = self._create_session()
-            saml_response = self._get_saml_response(session, username, password)
-        except PostcardCreatorException:
-            session = self._create_session()
-            saml_response = self._swissid_get_saml_response(session, username, password)
-        
+            session, saml_response = self._login_flow(first, username, password)
+        except PostcardCreatorException as e:
+            logger.debug('{} login failed ({!r}), trying {}'.format(first, e, second))
+            idp = second
+            session, saml_response = self._login_flow(second, username, password)
+
+        _measure('login', 'sso', self._fetch_access_token, session, saml_response)
+        self.idp = idp
+        logger.debug('username/password authentication was successful ({})'.format(idp))
+
+    def _login_flow(self, idp, username, password):
+        # returns (session, saml response) of one login flow
+        session = self._create_session()
+        if idp == IDP_POST:
+            return session, _measure('login', idp, self._get_saml_response, session, username, password)
+        try:
+            return session, _measure('login', idp, self._swissid_get_saml_response, session, username, password)
+        except requests.RequestException:
+            # connection errors are no hint at the login flow, they are raised
+            raise
+        except (KeyError, IndexError, AttributeError, ValueError) as e:
+            # the SwissID flow fails with parsing errors (missing fields, unexpected pages) when the
+            # account does not use it or the credentials are wrong
+            raise PostcardCreatorException('SwissID login failed: {!r}'.format(e)) from e
+
+    def _fetch_access_token(self, session, saml_response):
         payload = {
             'RelayState': '{}postcardcreator.post.ch?inMobileApp=true&inIframe=false&lang=en'.format(self.protocol),
             'SAMLResponse': saml_response
@@ -123,8 +343,6 @@ class Token(object):
             e.server_response = response.text
             raise e
 
-        logger.debug('username/password authentication was successful')
-
     def _get_saml_response(self, session, username, password):
         url = '{}/SAML/IdentityProvider/'.format(self.base)
         query = '?login&app=pcc&service=pcc&targetURL=https%3A%2F%2Fpostcardcreator.post.ch' + \
@@ -149,14 +367,12 @@ class Token(object):
         if any(e.status_code is not 200 for e in [response1, response2, response3]):
             raise PostcardCreatorException('Wrong user credentials')
 
-        soup = BeautifulSoup(response3.text, 'html.parser')
-        saml_response = soup.find('input', {'name': 'SAMLResponse'})
-
-        if saml_response is None or saml_response.get('value') is None:
+        saml_response = _extract_saml_response(response3.text)
+        if saml_response is None:
             raise PostcardCreatorException('Username/password authentication failed. '
                                            'Are your credentials valid?.')
 
-        return saml_response.get('value')
+        return saml_response
 
     def _swissid_get_saml_response(self, session, username, password):
         url = '{}/SAML/IdentityProvider/'.format(self.base)
@@ -216,14 +432,12 @@ class Token(object):
             response3, response4, response5, response6, response7]):
             raise PostcardCreatorException('Issue during authentication process, wrong credentials?')
 
-        soup = BeautifulSoup(response7.text, 'html.parser')
-        saml_response = soup.find('input', {'name': 'SAMLResponse'})
-
-        if saml_response is None or saml_response.get('value') is None:
+        saml_response = _extract_saml_response(response7.text)
+        if saml_response is None:
             raise PostcardCreatorException('Username/password authentication failed. '
                                            'Are your credentials valid?.')
 
-        return saml_response.get('value')
+        return saml_response
 
     def to_json(self):
         return {
@@ -231,10 +445,13 @@ class Token(object):
             'token': self.token,
             'expires_in': self.token_expires_in,
             'type': self.token_type,
+            'idp': self.idp,
         }
 
 
 class Sender(object):
+    __slots__ = ('prename', 'lastname', 'street', 'zip_code', 'place', 'company', 'country')
+
     def __init__(self, prename, lastname, street, zip_code, place, company='', country=''):
         self.prename = prename
         self.lastname = lastname
@@ -249,6 +466,8 @@ class Sender(object):
 
 
 class Recipient(object):
+    __slots__ = ('salutation', 'prename', 'lastname', 'street', 'zip_code', 'place', 'company', 'company_addition')
+
     def __init__(self, prename, lastname, street, zip_code, place, company='', company_addition='', salutation=''):
         self.salutation = salutation
         self.prename = prename
@@ -262,31 +481,43 @@ class Recipient(object):
     def is_valid(self):
         return all(field for field in [self.prename, self.lastname, self.street, self.zip_code, self.place])
 
+    def to_row(self):
+        return [self.salutation, self.prename,
+                self.lastname, self.company,
+                self.company_addition, self.street,
+                self.zip_code, self.place]
+
     def to_json(self):
-        return {'recipientFields': [
-            {'name': 'Salutation', 'addressField': 'SALUTATION'},
-            {'name': 'Given Name', 'addressField': 'GIVEN_NAME'},
-            {'name': 'Family Name', 'addressField': 'FAMILY_NAME'},
-            {'name': 'Company', 'addressField': 'COMPANY'},
-            {'name': 'Company', 'addressField': 'COMPANY_ADDITION'},
-            {'name': 'Street', 'addressField': 'STREET'},
-            {'name': 'Post Code', 'addressField': 'ZIP_CODE'},
-            {'name': 'Place', 'addressField': 'PLACE'}],
-            'recipients': [
-                [self.salutation, self.prename,
-                 self.lastname, self.company,
-                 self.company_addition, self.street,
-                 self.zip_code, self.place]]}
+        return recipients_json([self])
+
+
+def recipients_json(recipients):
+    # payload of PUT .../recipients, one row per recipient in the order of recipientFields
+    return {'recipientFields': [
+        {'name': 'Salutation', 'addressField': 'SALUTATION'},
+        {'name': 'Given Name', 'addressField': 'GIVEN_NAME'},
+        {'name': 'Family Name', 'addressField': 'FAMILY_NAME'},
+        {'name': 'Company', 'addressField': 'COMPANY'},
+        {'name': 'Company', 'addressField': 'COMPANY_ADDITION'},
+        {'name': 'Street', 'addressField': 'STREET'},
+        {'name': 'Post Code', 'addressField': 'ZIP_CODE'},
+        {'name': 'Place', 'addressField': 'PLACE'}],
+        'recipients': [recipient.to_row() for recipient in recipients]}
 
 
 class Postcard(object):
+    # picture_stream is a file object, bytes or a path. paths are only opened when the card is sent,
+    # so many postcards can share one picture without holding open files
+    __slots__ = ('recipient', 'message', 'picture_stream', 'sender', '_frontpage_template', '_backpage_template')
+
     def __init__(self, sender, recipient, picture_stream, message=''):
         self.recipient = recipient
         self.message = message
         self.picture_stream = picture_stream
         self.sender = sender
-        self.frontpage_layout = pkg_resources.resource_string(__name__, 'page_1.svg').decode('utf-8')
-        self.backpage_layout = pkg_resources.resource_string(__name__, 'page_2.svg').decode('utf-8')
+        # None uses the layouts shared by all postcards
+        self._frontpage_template = None
+        self._backpage_template = None
 
     def is_valid(self):
         return self.recipient is not None \
@@ -297,53 +528,135 @@ class Postcard(object):
     def validate(self):
         if self.recipient is None or not self.recipient.is_valid():
             raise PostcardCreatorException('Not all required attributes in recipient set')
-        if self.recipient is None or not self.recipient.is_valid():
+        if self.sender is None or not self.sender.is_valid():
             raise PostcardCreatorException('Not all required attributes in sender set')
 
+    @property
+    def frontpage_layout(self):
+        return self.frontpage_template().text
+
+    @frontpage_layout.setter
+    def frontpage_layout(self, layout):
+        # a custom SVG layout for this postcard, None restores the shared one
+        self._frontpage_template = SvgTemplate(layout) if layout is not None else None
+
+    @property
+    def backpage_layout(self):
+        return self.backpage_template().text
+
+    @backpage_layout.setter
+    def backpage_layout(self, layout):
+        self._backpage_template = SvgTemplate(layout) if layout is not None else None
+
+    def frontpage_template(self):
+        return self._frontpage_template or frontpage_template()
+
+    def backpage_template(self):
+        return self._backpage_template or backpage_template()
+
     def get_frontpage(self, asset_id):
-        return self.frontpage_layout.replace('{asset_id}', str(asset_id))
+        return self.frontpage_template().render({'asset_id': asset_id})
 
     def get_backpage(self):
-        svg = self.backpage_layout
-        return svg \
-            .replace('{first_name}', self.recipient.prename) \
-            .replace('{last_name}', self.recipient.lastname) \
-            .replace('{company}', self.recipient.company) \
-            .replace('{company_addition}', self.recipient.company_addition) \
-            .replace('{street}', self.recipient.street) \
-            .replace('{zip_code}', str(self.recipient.zip_code)) \
-            .replace('{place}', self.recipient.place) \
-            .replace('{sender_company}', self.sender.company) \
-            .replace('{sender_name}', self.sender.prename + ' ' + self.sender.lastname) \
-            .replace('{sender_address}', self.sender.street) \
-            .replace('{sender_zip_code}', str(self.sender.zip_code)) \
-            .replace('{sender_place}', self.sender.place) \
-            .replace('{sender_country}', self.sender.country) \
-            .replace('{message}',
-                     self.message.encode('ascii', 'xmlcharrefreplace').decode('utf-8'))  # escape umlaute
+        return self.backpage_template().render(backpage_values(self.sender, self.recipient, self.message))
+
+
+def _close_picture(picture):
+    if hasattr(picture, 'close'):
+        picture.close()
+
+
+def _picture_bytes(picture):
+    # the scaled picture as bytes, so it can be uploaded more than once
+    if isinstance(picture, bytes):
+        return picture
+    try:
+        picture.seek(0)
+        return picture.read()
+    finally:
+        _close_picture(picture)
+
+
+def _close_scaled_picture(future):
+    if not future.cancelled() and future.exception() is None:
+        _close_picture(future.result())
+
+
+class _BufferReader(object):
+    # read only file object over a buffer, e.g. a memoryview of a memory mapped file.
+    # only the parts that are read are copied
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._position = 0
+
+    def __len__(self):
+        return len(self._view) - self._position
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._position + size, len(self._view))
+        data = self._view[self._position:end].tobytes()
+        self._position = end
+        return data
+
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self._position, 2: len(self._view)}[whence]
+        self._position = max(0, min(base + offset, len(self._view)))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._view.release()
 
 
 def _send_free_card_defaults(func):
+    @functools.wraps(func)
     def wrapped(*args, **kwargs):
         kwargs['image_target_width'] = kwargs.get('image_target_width') or 154
         kwargs['image_target_height'] = kwargs.get('image_target_height') or 111
         kwargs['image_quality_factor'] = kwargs.get('image_quality_factor') or 20
         kwargs['image_rotate'] = kwargs.get('image_rotate') or True
         kwargs['image_export'] = kwargs.get('image_export') or False
+        kwargs['image_fast'] = kwargs.get('image_fast') or False
+        kwargs['image_format'] = kwargs.get('image_format') or 'PNG'
+        kwargs['image_quality'] = kwargs.get('image_quality') or 90
         return func(*args, **kwargs)
 
     return wrapped
 
 
 class PostcardCreator(object):
-    def __init__(self, token=None, _protocol='https://'):
+    def __init__(self, token=None, _protocol='https://', cache_ttl=60, image_processor=None,
+                 image_cache=None, asset_cache=None, transport=None, retry_policy=None, journal=None):
         if token.token is None:
             raise PostcardCreatorException('No Token given')
         self.token = token
         self.protocol = _protocol
+        self.transport = transport
+        # postcard_creator.retry.RetryPolicy, default_retry_policy if not set
+        self.retry_policy = retry_policy
         self.host = '{}postcardcreator.post.ch/rest/2.1'.format(self.protocol)
         self._session = self._create_session()
 
+        # responses of /users/current and quota are reused for cache_ttl seconds, 0 disables caching
+        self.cache_ttl = cache_ttl
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+        # optional postcard_creator.imaging.ImageProcessor to scale images in worker processes
+        self.image_processor = image_processor
+
+        # optional postcard_creator.cache.ImageCache/ DiskImageCache and AssetCache, to skip
+        # scaling and uploading images which were sent before
+        self.image_cache = image_cache
+        self.asset_cache = asset_cache
+
+        # optional postcard_creator.journal.SendJournal for send_free_card(idempotency_key=...)
+        self.journal = journal
+
     def _get_headers(self):
         return {
             'User-Agent': 'Mozilla/5.0 (Linux; Android 6.0.1; wv) AppleWebKit/537.36 (KHTML, like Gecko) '
@@ -352,25 +665,91 @@ class PostcardCreator(object):
         }
 
     def _create_session(self):
-        return requests.Session()
+        return (self.transport or get_default_transport()).create_session()
 
     def _do_op(self, method, endpoint, **kwargs):
         url = self.host + endpoint
         if 'headers' not in kwargs or kwargs['headers'] is None:
             kwargs['headers'] = self._get_headers()
 
-        logger.debug('{}: {}'.format(method, url))
-        response = self._session.request(method, url, **kwargs)
-        _trace_request(response)
-
-        if response.status_code not in [200, 201, 204]:
-            e = PostcardCreatorException('error in request {} {}. status_code: {}'
-                                         .format(method, url, response.status_code))
-            e.server_response = response.text
-            raise e
-        return response
+        # streamed bodies can only be sent once, body_factory creates a new one per attempt
+        body_factory = kwargs.pop('body_factory', None)
+        retry_policy = self.retry_policy or default_retry_policy
+        rate_limiter = get_rate_limiter(urlparse(url).netloc)
+
+        attempt = 0
+        while True:
+            if body_factory is not None:
+                kwargs['data'] = body_factory()
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+
+            logger.debug('{}: {}'.format(method, url))
+            started = time.perf_counter() if instrumentation.active else None
+            try:
+                response = self._session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if started is not None:
+                    instrumentation.record('request', endpoint_name(method, endpoint),
+                                           time.perf_counter() - started, status='error')
+                delay = retry_policy.get_delay(attempt) if retry_policy.is_retryable(method, exception=e) else None
+                if delay is None:
+                    raise
+                logger.debug('{} {} failed ({}), retrying in {:.1f}s'.format(method, url, e, delay))
+            else:
+                if started is not None:
+                    instrumentation.record('request', endpoint_name(method, endpoint),
+                                           time.perf_counter() - started, status=response.status_code,
+                                           bytes_sent=_body_size(response.request.body),
+                                           bytes_received=len(response.content))
+                _trace_request(response)
+                if response.status_code in [200, 201, 204]:
+                    return response
+
+                delay = retry_policy.get_delay(attempt, response) \
+                    if retry_policy.is_retryable(method, response=response) else None
+                if delay is None:
+                    e = PostcardCreatorException('error in request {} {}. status_code: {}'
+                                                 .format(method, url, response.status_code))
+                    e.server_response = response.text
+                    raise e
+                logger.debug('{} {} returned status_code {}, retrying in {:.1f}s'
+                             .format(method, url, response.status_code, delay))
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _cached(self, key, loader):
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            hit = entry is not None and entry[0] > now
+            if hit:
+                self.cache_hits += 1
+                value = copy.deepcopy(entry[1])
+            else:
+                self.cache_misses += 1
+        _count_cache(key, hit)
+        if hit:
+            return value
+
+        value = loader()
+        if self.cache_ttl:
+            with self._cache_lock:
+                self._cache[key] = (now + self.cache_ttl, copy.deepcopy(value))
+        return value
+
+    def invalidate_cache(self, key=None):
+        with self._cache_lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
 
     def get_user_info(self):
+        return self._cached('user', self._fetch_user_info)
+
+    def _fetch_user_info(self):
         logger.debug('fetching user information')
         endpoint = '/users/current'
         return self._do_op('get', endpoint).json()
@@ -383,17 +762,29 @@ class PostcardCreator(object):
         return self._do_op('get', endpoint).json()
 
     def get_quota(self):
+        return self._cached('quota', self._fetch_quota)
+
+    def _fetch_quota(self):
         logger.debug('fetching quota')
 
         user = self.get_user_info()
         endpoint = '/users/{}/quota'.format(user["userId"])
-        return self._do_op('get', endpoint).json()
+        quota = self._do_op('get', endpoint).json()
+        if instrumentation.active:
+            instrumentation.record('quota', str(user['userId']), 0.0,
+                                   status='available' if quota.get('available') else 'exhausted')
+        return quota
 
     def has_free_postcard(self):
         return self.get_quota()['available']
 
     @_send_free_card_defaults
-    def send_free_card(self, postcard, mock_send=False, **kwargs):
+    def send_free_card(self, postcard, mock_send=False, pipeline=False, idempotency_key=None, **kwargs):
+        if idempotency_key is not None:
+            return self._send_free_card_journaled(postcard, idempotency_key, mock_send=mock_send, **kwargs)
+        if pipeline:
+            return self._send_free_card_pipelined(postcard, mock_send=mock_send, **kwargs)
+
         if not self.has_free_postcard():
             raise PostcardCreatorException('Limit of free postcards exceeded. Try again tomorrow at '
                                            + self.get_quota()['next'])
@@ -405,12 +796,179 @@ class PostcardCreator(object):
         user_id = user['userId']
         card_id = self._create_card(user)
 
-        picture_stream = self._rotate_and_scale_image(postcard.picture_stream, **kwargs)
-        asset_response = self._upload_asset(user, picture_stream=picture_stream)
+        picture = self._scale_picture(postcard.picture_stream, **kwargs)
+        try:
+            asset_id = self._upload_picture(user, picture, image_format=kwargs['image_format'])
+        finally:
+            _close_picture(picture)
         self._set_card_recipient(user_id=user_id, card_id=card_id, postcard=postcard)
-        self._set_svg_page(1, user_id, card_id, postcard.get_frontpage(asset_id=asset_response['asset_id']))
+        self._set_svg_page(1, user_id, card_id, postcard.get_frontpage(asset_id=asset_id))
         self._set_svg_page(2, user_id, card_id, postcard.get_backpage())
 
+        return self._order_card(user_id, card_id, mock_send)
+
+    @_send_free_card_defaults
+    def send_mailing(self, sender, recipients, picture_stream, message='', mock_send=False, **kwargs):
+        """
+        Sends the same picture and message to many recipients, one free postcard each. Yields the
+        response of each card as it is ordered.
+
+        A mailing has a single back page, so every recipient gets a mailing of its own with the address
+        rendered on the back page. The picture is scaled once for all cards. Raises PostcardCreatorException
+        when the free postcards run out, the cards yielded before were sent.
+        """
+        postcards = [Postcard(sender, recipient, None, message) for recipient in recipients]
+        if not postcards:
+            raise PostcardCreatorException('No recipients given')
+        for postcard in postcards:
+            postcard.validate()
+
+        picture = None
+        for postcard in postcards:
+            if not self.has_free_postcard():
+                raise PostcardCreatorException('Limit of free postcards exceeded. Try again tomorrow at '
+                                               + self.get_quota()['next'])
+            if picture is None:
+                picture = _picture_bytes(self._scale_picture(picture_stream, **kwargs))
+
+            user = self.get_user_info()
+            user_id = user['userId']
+            card_id = self._create_card(user)
+            asset_id = self._upload_picture(user, picture, image_format=kwargs['image_format'])
+            self._set_card_recipient(user_id=user_id, card_id=card_id, postcard=postcard)
+            self._set_svg_page(1, user_id, card_id, postcard.get_frontpage(asset_id=asset_id))
+            self._set_svg_page(2, user_id, card_id, postcard.get_backpage())
+            yield self._order_card(user_id, card_id, mock_send)
+
+    def send_prepared_card(self, card, mock_send=False, before_order=None):
+        # sends a postcard_creator.spool.PreparedCard, the image is scaled and the pages are rendered already.
+        # before_order() is called right before the card is ordered
+        if not self.has_free_postcard():
+            raise PostcardCreatorException('Limit of free postcards exceeded. Try again tomorrow at '
+                                           + self.get_quota()['next'])
+        user = self.get_user_info()
+        user_id = user['userId']
+        card_id = self._create_card(user)
+
+        asset_id = self._upload_picture(user, card.image, image_format=card.image_format)
+        self._put_recipients(user_id, card_id, card.recipient)
+        self._set_svg_page(1, user_id, card_id, card.get_frontpage(asset_id))
+        self._set_svg_page(2, user_id, card_id, card.page_2)
+
+        if before_order is not None and not mock_send:
+            before_order()
+        return self._order_card(user_id, card_id, mock_send)
+
+    def _send_free_card_pipelined(self, postcard, mock_send=False, **kwargs):
+        # same steps as send_free_card, but steps that do not depend on each other run concurrently:
+        #   image scaling            || quota check, user lookup, mailing creation
+        #   asset upload + page 1    || recipient and page 2
+        # all steps have completed before the card is ordered.
+        if not postcard:
+            raise PostcardCreatorException('Postcard must be set')
+        postcard.validate()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            picture = executor.submit(self._scale_picture, postcard.picture_stream, **kwargs)
+            try:
+                if not self.has_free_postcard():
+                    raise PostcardCreatorException('Limit of free postcards exceeded. Try again tomorrow at '
+                                                   + self.get_quota()['next'])
+                user = self.get_user_info()
+                user_id = user['userId']
+                card_id = self._create_card(user)
+
+                def upload_and_set_frontpage():
+                    try:
+                        asset_id = self._upload_picture(user, picture.result(),
+                                                        image_format=kwargs['image_format'])
+                    finally:
+                        _close_picture(picture.result())
+                    self._set_svg_page(1, user_id, card_id, postcard.get_frontpage(asset_id=asset_id))
+
+                steps = [
+                    executor.submit(upload_and_set_frontpage),
+                    executor.submit(self._set_card_recipient, user_id=user_id, card_id=card_id, postcard=postcard),
+                    executor.submit(self._set_svg_page, 2, user_id, card_id, postcard.get_backpage())
+                ]
+                for step in steps:
+                    step.result()
+            finally:
+                # scaling is usually running already when a step fails, the picture is closed once
+                # it is done. closing an uploaded picture again is a no-op
+                picture.add_done_callback(_close_scaled_picture)
+
+        return self._order_card(user_id, card_id, mock_send)
+
+    def _send_free_card_journaled(self, postcard, key, mock_send=False, **kwargs):
+        # every completed step is recorded in the journal, a retry with the same key resumes
+        # after the last completed step and never orders a card twice
+        if self.journal is None:
+            raise PostcardCreatorException('idempotency_key requires a journal')
+
+        entry = self.journal.get(key) or {}
+        if entry.get('ordered'):
+            logger.info('postcard {} was already ordered, not sending it again'.format(key))
+            return None
+        if entry.get('order_started'):
+            raise PostcardCreatorException('postcard {} may have been ordered before the process stopped. '
+                                           'check the mailings of the account and delete the key from the '
+                                           'journal to send it again'.format(key))
+
+        if not self.has_free_postcard():
+            raise PostcardCreatorException('Limit of free postcards exceeded. Try again tomorrow at '
+                                           + self.get_quota()['next'])
+        if not postcard:
+            raise PostcardCreatorException('Postcard must be set')
+
+        postcard.validate()
+        user = self.get_user_info()
+        user_id = user['userId']
+        if entry.get('user_id') not in (None, str(user_id)):
+            logger.debug('postcard {} was started with another account, starting over'.format(key))
+            entry = {}
+
+        card_id = entry.get('card_id')
+        if card_id is None:
+            card_id = self._create_card(user)
+            self.journal.update(key, user_id=str(user_id), card_id=card_id, asset_id=None,
+                                recipient_set=False, pages_set=False)
+        else:
+            logger.debug('resuming postcard {} with mailing {}'.format(key, card_id))
+
+        if not entry.get('pages_set'):
+            asset_id = entry.get('asset_id')
+            if asset_id is None:
+                picture = self._scale_picture(postcard.picture_stream, **kwargs)
+                try:
+                    asset_id = self._upload_picture(user, picture, image_format=kwargs['image_format'])
+                finally:
+                    _close_picture(picture)
+                self.journal.update(key, asset_id=asset_id)
+
+        if not entry.get('recipient_set'):
+            self._set_card_recipient(user_id=user_id, card_id=card_id, postcard=postcard)
+            self.journal.update(key, recipient_set=True)
+
+        if not entry.get('pages_set'):
+            self._set_svg_page(1, user_id, card_id, postcard.get_frontpage(asset_id=asset_id))
+            self._set_svg_page(2, user_id, card_id, postcard.get_backpage())
+            self.journal.update(key, pages_set=True)
+
+        if mock_send:
+            return self._order_card(user_id, card_id, mock_send)
+
+        self.journal.update(key, order_started=True)
+        try:
+            response = self._order_card(user_id, card_id, mock_send)
+        except PostcardCreatorException:
+            # the server answered, the card was not ordered
+            self.journal.update(key, order_started=False)
+            raise
+        self.journal.update(key, ordered=True)
+        return response
+
+    def _order_card(self, user_id, card_id, mock_send):
         if mock_send:
             response = False
             logger.debug('postcard was not sent because flag mock_send=True')
@@ -432,17 +990,42 @@ class PostcardCreator(object):
         mailing_response = self._do_op('post', endpoint, json=mailing_payload)
         return mailing_response.headers['Location'].partition('mailings/')[2]
 
-    def _upload_asset(self, user, picture_stream):
+    def _upload_asset(self, user, picture_stream, image_format='PNG'):
         logger.debug('uploading postcard asset')
         endpoint = '/users/{}/assets'.format(user["userId"])
 
-        files = {
-            'title': (None, 'Title of image'),
-            'asset': ('asset.png', picture_stream, 'image/jpeg')
-        }
+        reader = None
+        if isinstance(picture_stream, bytes):
+            # shares the buffer of the bytes object, the image is not copied
+            picture_stream = BytesIO(picture_stream)
+        elif isinstance(picture_stream, memoryview):
+            picture_stream = reader = _BufferReader(picture_stream)
+        elif isinstance(picture_stream, tempfile.SpooledTemporaryFile) and not picture_stream._rolled:
+            # the encoder calls fileno(), which writes a spooled file to disk. an image that is still
+            # in memory is read from the buffer of its BytesIO instead
+            picture_stream = reader = _BufferReader(picture_stream._file.getbuffer())
+
+        # the multipart body is streamed from picture_stream instead of being built in memory
+        from requests_toolbelt import MultipartEncoder
+        filename, mime_type = image_file_type(image_format)
+        boundary = uuid.uuid4().hex
+
+        def create_body():
+            picture_stream.seek(0)
+            return MultipartEncoder(fields=[
+                ('title', 'Title of image'),
+                ('asset', (filename, picture_stream, mime_type))
+            ], boundary=boundary)
+
         headers = self._get_headers()
         headers['Origin'] = 'file://'
-        response = self._do_op('post', endpoint, files=files, headers=headers)
+        headers['Content-Type'] = 'multipart/form-data; boundary={}'.format(boundary)
+        try:
+            response = self._do_op('post', endpoint, body_factory=create_body, headers=headers)
+        finally:
+            if reader is not None:
+                # releases the buffer, so the BytesIO or memory map can be closed
+                reader.close()
         asset_id = response.headers['Location'].partition('user/')[2]
 
         return {
@@ -450,10 +1033,28 @@ class PostcardCreator(object):
             'response': response
         }
 
+    def _upload_picture(self, user, picture, image_format='PNG'):
+        if self.asset_cache is None:
+            return self._upload_asset(user, picture_stream=picture, image_format=image_format)['asset_id']
+
+        key = asset_cache_key(picture, user['userId'])
+        asset_id = self.asset_cache.get(key)
+        _count_cache('asset', asset_id is not None)
+        if asset_id is not None:
+            logger.debug('postcard asset was uploaded before, reusing asset {}'.format(asset_id))
+            return asset_id
+
+        asset_id = self._upload_asset(user, picture_stream=picture, image_format=image_format)['asset_id']
+        self.asset_cache.set(key, asset_id)
+        return asset_id
+
     def _set_card_recipient(self, user_id, card_id, postcard):
+        return self._put_recipients(user_id, card_id, postcard.recipient.to_json())
+
+    def _put_recipients(self, user_id, card_id, payload):
         logger.debug('set recipient for postcard')
         endpoint = '/users/{}/mailings/{}/recipients'.format(user_id, card_id)
-        return self._do_op('put', endpoint, json=postcard.recipient.to_json())
+        return self._do_op('put', endpoint, json=payload)
 
     def _set_svg_page(self, page_number, user_id, card_id, svg_content):
         logger.debug('set svg template ' + str(page_number) + ' for postcard')
@@ -467,44 +1068,37 @@ class PostcardCreator(object):
     def _do_order(self, user_id, card_id):
         logger.debug('submit postcard to be printed and delivered')
         endpoint = '/users/{}/mailings/{}/order'.format(user_id, card_id)
-        return self._do_op('post', endpoint, json={})
-
-    def _rotate_and_scale_image(self, file, image_target_width=154, image_target_height=111,
-                                image_quality_factor=20, image_rotate=True, image_export=False):
-
-        with Image.open(file) as image:
-            if image_rotate and image.width < image.height:
-                image = image.rotate(90, expand=True)
-                logger.debug('rotating image by 90 degrees')
-
-            if image.width < image_quality_factor * image_target_width \
-                    or image.height < image_quality_factor * image_target_height:
-                factor_width = math.floor(image.width / image_target_width)
-                factor_height = math.floor(image.height / image_target_height)
-                factor = min([factor_height, factor_width])
-
-                logger.debug('image is smaller than default for resize/fill. '
-                             'using scale factor {} instead of {}'.format(factor, image_quality_factor))
-                image_quality_factor = factor
-
-            width = image_target_width * image_quality_factor
-            height = image_target_height * image_quality_factor
-            logger.debug('resizing image from {}x{} to {}x{}'
-                         .format(image.width, image.height, width, height))
-
-            cover = resizeimage.resize_cover(image, [width, height], validate=True)
-            with BytesIO() as f:
-                cover.save(f, 'PNG')
-                scaled = f.getvalue()
-
-            if image_export:
-                name = strftime("postcard_creator_export_%Y-%m-%d_%H-%M-%S.jpg", gmtime())
-                path = os.path.join(os.getcwd(), name)
-                logger.info('exporting image to {} (image_export=True)'.format(path))
-                cover.save(path)
-
+        try:
+            return self._do_op('post', endpoint, json={})
+        finally:
+            # ordering uses up the free postcard of the day
+            self.invalidate_cache('quota')
+
+    def _scale_picture(self, file, **kwargs):
+        if self.image_cache is None:
+            if self.image_processor is None and self.asset_cache is None:
+                out = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE)
+                return self._rotate_and_scale_image(file, out=out, **kwargs)
+            return self._rotate_and_scale_image(file, **kwargs)
+
+        data = read_picture(file)
+        key = image_cache_key(data, kwargs)
+        scaled = self.image_cache.get(key)
+        _count_cache('image', scaled is not None)
+        if scaled is not None:
+            logger.debug('using cached postcard image')
+            return scaled
+
+        scaled = self._rotate_and_scale_image(data, **kwargs)
+        self.image_cache.set(key, scaled)
         return scaled
 
+    def _rotate_and_scale_image(self, file, **kwargs):
+        if self.image_processor is not None:
+            return _measure('image', 'rotate_and_scale', self.image_processor.process, file,
+                            _size=_picture_size, **kwargs)
+        return _measure('image', 'rotate_and_scale', rotate_and_scale_image, file, _size=_picture_size, **kwargs)
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO,
@@ -0,0 +1,118 @@
+import datetime
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+# the server did not process the request, it can be sent again whatever the method
+RETRY_ANY_METHOD_STATUSES = frozenset([429, 503])
+# the request may have been processed, only idempotent requests are sent again
+RETRY_IDEMPOTENT_STATUSES = frozenset([500, 502, 504])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or a http date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date is None:
+        return None
+    now = datetime.datetime.now(date.tzinfo or datetime.timezone.utc)
+    return max((date - now).total_seconds(), 0)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed request of PostcardCreator._do_op is sent again and how long to wait.
+
+    Waits follow Retry-After if the server sends one (requests asking for more than
+    max_retry_after seconds are not retried), otherwise exponential backoff with full jitter.
+    """
+
+    def __init__(self, max_attempts=4, backoff=0.5, max_backoff=30, jitter=True, max_retry_after=120):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+
+    def is_retryable(self, method, response=None, exception=None):
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        if exception is not None:
+            return idempotent and isinstance(exception, (requests.ConnectionError, requests.Timeout))
+        if response.status_code in RETRY_ANY_METHOD_STATUSES:
+            return True
+        return idempotent and response.status_code in RETRY_IDEMPOTENT_STATUSES
+
+    def get_delay(self, attempt, response=None):
+        # returns None if the request should not be retried anymore
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after if retry_after <= self.max_retry_after else None
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing rate requests per second with bursts of up to burst requests.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        # takes a token and returns 0 or returns the seconds until a token is available
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+default_retry_policy = RetryPolicy()
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def set_rate_limit(host, rate, burst=None):
+    # limits the requests of all PostcardCreator instances to host, e.g. 'postcardcreator.post.ch'.
+    # rate None removes the limit
+    with _rate_limiters_lock:
+        if rate is None:
+            _rate_limiters.pop(host, None)
+        else:
+            _rate_limiters[host] = RateLimiter(rate, burst)
+
+
+def get_rate_limiter(host):
+    with _rate_limiters_lock:
+        return _rate_limiters.get(host)
@@ -0,0 +1,251 @@
+import collections
+import concurrent.futures
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+from postcard_creator.cache import ImageCache, image_cache_key
+from postcard_creator.imaging import image_file_type, read_picture, rotate_and_scale_image
+from postcard_creator.postcard_creator import PostcardCreatorException, _send_free_card_defaults
+from postcard_creator.templates import render_pages
+
+logger = logging.getLogger('postcard_creator')
+
+# a card file is MAGIC, the length of a json header (uint32, little endian), the header and the sections
+# in the order of SECTIONS. the header holds the image format and the length of each section
+MAGIC = b'PCCARD1\n'
+SECTIONS = ('image', 'page_1', 'page_2', 'recipient')
+CARD_SUFFIX = '.card'
+SENT_SUFFIX = '.sent'
+# a card is renamed to .ordering right before it is ordered. it may have been ordered if sending
+# was interrupted, it is only sent again with resend_ordering=True
+ORDERING_SUFFIX = '.ordering'
+
+# page_1 is stored with this placeholder, it is replaced by the asset id when the card is sent
+ASSET_PLACEHOLDER = '{asset_id}'
+
+_HEADER_LENGTH = struct.Struct('<I')
+
+# result of one card of submit_spool, exception is the exception sending failed with
+SubmitResult = collections.namedtuple('SubmitResult', ['path', 'response', 'exception'])
+
+
+class PreparedCard(object):
+    """
+    A card ready to be sent: scaled image, rendered pages and recipient payload.
+    Read from a spool file with read_card().
+    """
+
+    __slots__ = ('image', 'image_format', 'page_1', 'page_2', 'recipient', 'path', '_mapping')
+
+    def __init__(self, image, image_format, page_1, page_2, recipient, path=None, _mapping=None):
+        self.image = image
+        self.image_format = image_format
+        self.page_1 = page_1
+        self.page_2 = page_2
+        self.recipient = recipient
+        self.path = path
+        self._mapping = _mapping
+
+    def get_frontpage(self, asset_id):
+        return self.page_1.replace(ASSET_PLACEHOLDER, asset_id)
+
+    def close(self):
+        # releases the memory mapped file of a card read with read_card()
+        mapping, self._mapping = self._mapping, None
+        if mapping is None:
+            return
+        if isinstance(self.image, memoryview):
+            self.image.release()
+        try:
+            mapping.close()
+        except BufferError:
+            # still exported by a reader of the image, it is closed once the reader is garbage collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_card(path, card):
+    sections = [
+        bytes(card.image),
+        card.page_1.encode('utf-8'),
+        card.page_2.encode('utf-8'),
+        json.dumps(card.recipient, separators=(',', ':')).encode('utf-8'),
+    ]
+    header = json.dumps({
+        'image_format': card.image_format,
+        'sections': [len(section) for section in sections],
+    }).encode('utf-8')
+
+    # written to a temporary file and renamed, a card file is either complete or missing
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for section in sections:
+                f.write(section)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def read_card(path):
+    # the file is memory mapped and the image is a memoryview of the mapping, it is not copied into
+    # memory but read from the page cache while it is uploaded. close() the card to release the mapping
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a card file'.format(path))
+        offset = len(MAGIC) + _HEADER_LENGTH.size
+        header_length, = _HEADER_LENGTH.unpack_from(data, len(MAGIC))
+        header = json.loads(data[offset:offset + header_length].decode('utf-8'))
+        offset += header_length
+
+        sections = {}
+        for name, length in zip(SECTIONS, header['sections']):
+            sections[name] = (offset, offset + length)
+            offset += length
+
+        def text(name):
+            start, end = sections[name]
+            return data[start:end].decode('utf-8')
+
+        start, end = sections['image']
+        return PreparedCard(image=memoryview(data)[start:end],
+                            image_format=header['image_format'],
+                            page_1=text('page_1'),
+                            page_2=text('page_2'),
+                            recipient=json.loads(text('recipient')),
+                            path=path,
+                            _mapping=data)
+    except Exception:
+        data.close()
+        raise
+
+
+def _scale(picture, image_cache, image_processor, kwargs):
+    # the scaled image is reused for cards with the same picture and image options
+    data = read_picture(picture)
+    key = image_cache_key(data, kwargs)
+    scaled = image_cache.get(key)
+    if scaled is None:
+        if image_processor is not None:
+            scaled = image_processor.process(data, **kwargs)
+        else:
+            scaled = rotate_and_scale_image(data, **kwargs)
+        image_cache.set(key, scaled)
+    return scaled
+
+
+@_send_free_card_defaults
+def prepare_cards(postcards, directory, image_cache=None, image_processor=None, **kwargs):
+    """
+    Scales the picture, renders the pages and the recipient payload of each postcard and writes
+    them to a card file in directory. Yields the path of each card file.
+
+    Nothing is sent, submit_spool() sends the cards. kwargs are the image options of send_free_card.
+    Cards sharing a picture path are scaled once. Cards already prepared, ordering or sent from
+    directory are skipped, so an interrupted run can be started again with the same postcards.
+    """
+    image_file_type(kwargs['image_format'])
+    image_cache = image_cache if image_cache is not None else ImageCache()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # the pages are rendered in lockstep with the postcards, sender fields are reused between cards
+    postcards, rendered = itertools.tee(postcards)
+    pages = render_pages(rendered, asset_id=ASSET_PLACEHOLDER)
+    last_path = last_image = None
+    for i, (postcard, (page_1, page_2)) in enumerate(zip(postcards, pages)):
+        name = os.path.join(directory, '{:08d}'.format(i))
+        path = name + CARD_SUFFIX
+        if any(os.path.exists(name + suffix) for suffix in (CARD_SUFFIX, ORDERING_SUFFIX, SENT_SUFFIX)):
+            continue
+
+        postcard.validate()
+        picture = postcard.picture_stream
+        if isinstance(picture, str) and picture == last_path:
+            image = last_image
+        else:
+            image = _scale(picture, image_cache, image_processor, kwargs)
+            last_path, last_image = (picture, image) if isinstance(picture, str) else (None, None)
+
+        card = PreparedCard(image, kwargs['image_format'].upper(), page_1, page_2, postcard.recipient.to_json())
+        write_card(path, card)
+        logger.debug('prepared postcard {}'.format(path))
+        yield path
+
+
+def spooled_cards(directory, resend_ordering=False):
+    # paths of the card files in directory that were not sent yet, in the order they were prepared.
+    # with resend_ordering, cards whose sending was interrupted while ordering are included
+    suffixes = (CARD_SUFFIX, ORDERING_SUFFIX) if resend_ordering else (CARD_SUFFIX,)
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(suffixes))
+
+
+def _with_suffix(path, suffix):
+    return os.path.splitext(path)[0] + suffix
+
+
+def _submit(sender, path, mock_send):
+    ordering = _with_suffix(path, ORDERING_SUFFIX)
+    marked = []
+
+    def before_order():
+        # once the card is marked it is not sent again by accident, even if this process dies
+        os.replace(path, ordering)
+        marked.append(ordering)
+
+    try:
+        with read_card(path) as card:
+            response = sender.send_prepared_card(card, mock_send=mock_send, before_order=before_order)
+        if not mock_send:
+            os.replace(ordering, _with_suffix(path, SENT_SUFFIX))
+        return SubmitResult(path, response, None)
+    except PostcardCreatorException as e:
+        # the server answered, the card was not ordered and may be sent again
+        if marked:
+            os.replace(ordering, path)
+        logger.debug('sending postcard {} failed: {}'.format(path, e))
+        return SubmitResult(path, None, e)
+    except Exception as e:
+        # after a connection error while ordering, the card stays .ordering: it may have been ordered
+        logger.debug('sending postcard {} failed: {}'.format(path, e))
+        return SubmitResult(path, None, e)
+
+
+def submit_spool(sender, directory, max_workers=1, mock_send=False, resend_ordering=False):
+    """
+    Sends the cards prepared in directory with sender, a PostcardCreator or an
+    postcard_creator.pool.AccountPool. Yields a SubmitResult per card as soon as it completes.
+    A PostcardCreator sends from one account, use max_workers > 1 with an AccountPool.
+
+    A card is renamed to .ordering right before it is ordered and to .sent once it was ordered,
+    a later submit_spool() only sends the cards left. Cards left .ordering by an interrupted run
+    may have been ordered, they are only sent again with resend_ordering=True.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for path in spooled_cards(directory, resend_ordering=resend_ordering):
+            pending.add(executor.submit(_submit, sender, path, mock_send))
+            if len(pending) >= 2 * max_workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
@@ -0,0 +1,94 @@
+import functools
+import pkgutil
+import re
+from xml.sax.saxutils import escape
+
+_PLACEHOLDER = re.compile(r'{([a-z_]+)}')
+
+
+def escape_svg(value):
+    # xml escaping plus character references for everything outside ascii (umlaute)
+    if value is None:
+        return ''
+    return escape(str(value)).encode('ascii', 'xmlcharrefreplace').decode('ascii')
+
+
+class SvgTemplate(object):
+    """
+    SVG layout with {name} placeholders, split once into literal parts and
+    fields so a card is rendered with a single join.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._parts = _PLACEHOLDER.split(text)
+        # odd parts are placeholder names, remember their positions
+        self._slots = [(i, self._parts[i]) for i in range(1, len(self._parts), 2)]
+        self.fields = frozenset(name for _, name in self._slots)
+
+    def render(self, values):
+        parts = list(self._parts)
+        for i, name in self._slots:
+            parts[i] = escape_svg(values.get(name))
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(name):
+    return SvgTemplate(pkgutil.get_data(__package__, name).decode('utf-8'))
+
+
+def frontpage_template():
+    return get_template('page_1.svg')
+
+
+def backpage_template():
+    return get_template('page_2.svg')
+
+
+def sender_values(sender):
+    return {
+        'sender_company': sender.company,
+        'sender_name': '{} {}'.format(sender.prename, sender.lastname),
+        'sender_address': sender.street,
+        'sender_zip_code': sender.zip_code,
+        'sender_place': sender.place,
+        'sender_country': sender.country,
+    }
+
+
+def backpage_values(sender, recipient, message, sender_fields=None):
+    values = dict(sender_fields or sender_values(sender))
+    values.update({
+        'first_name': recipient.prename,
+        'last_name': recipient.lastname,
+        'company': recipient.company,
+        'company_addition': recipient.company_addition,
+        'street': recipient.street,
+        'zip_code': recipient.zip_code,
+        'place': recipient.place,
+        'message': message,
+    })
+    return values
+
+
+def render_pages(postcards, asset_id=None):
+    """
+    Yields (frontpage, backpage) for each postcard. The front page only depends on the
+    asset and is rendered once, sender fields are reused for consecutive cards of one sender.
+    Postcards with a custom layout are rendered with it.
+    """
+    shared = frontpage_template()
+    frontpage = shared.render({'asset_id': asset_id}) if asset_id is not None else None
+    sender = sender_fields = None
+    for postcard in postcards:
+        if postcard.sender is not sender:
+            sender = postcard.sender
+            sender_fields = sender_values(sender)
+        front = postcard.frontpage_template()
+        if front is not shared and asset_id is not None:
+            front_page = front.render({'asset_id': asset_id})
+        else:
+            front_page = frontpage
+        yield front_page, postcard.backpage_template().render(
+            backpage_values(sender, postcard.recipient, postcard.message, sender_fields=sender_fields))
@@ -0,0 +1,87 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# connections kept per host. covers the default thread pool of postcard_creator.aio (64 threads),
+# connections beyond the pool size are closed after each request instead of being reused.
+# connections are only opened when needed, a large pool costs nothing while idle
+DEFAULT_POOL_MAXSIZE = 64
+
+
+class _Session(requests.Session):
+    # a session with a default timeout. its adapters belong to the transport
+    # and are shared with other sessions, closing the session keeps them open
+
+    def __init__(self, timeout=None):
+        super(_Session, self).__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(_Session, self).request(method, url, **kwargs)
+
+    def close(self):
+        pass
+
+
+class Transport(object):
+    """
+    Connection pools shared by the sessions of all Token and PostcardCreator instances.
+
+    Every session keeps its own cookies but uses the pooled keep-alive connections of the
+    transport, so new accounts and logins reuse warm TCP/TLS connections.
+
+    pool_maxsize: connections kept per host, at least the number of threads sending at the same time
+        (max_workers of send_batch/submit_spool, three per card with pipeline=True)
+    pool_sizes: per host overrides, e.g. {'https://postcardcreator.post.ch': 50}
+    max_retries: retries of failed connection attempts (the request was not sent yet)
+    timeout: default (connect, read) timeout in seconds
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_sizes=None, max_retries=2,
+                 timeout=(10, 60)):
+        self.timeout = timeout
+        self._adapters = {}
+        for prefix in ['https://', 'http://']:
+            self._adapters[prefix] = self._create_adapter(pool_connections, pool_maxsize, max_retries)
+        for prefix, size in (pool_sizes or {}).items():
+            self._adapters[prefix] = self._create_adapter(1, size, max_retries)
+
+    def _create_adapter(self, pool_connections, pool_maxsize, max_retries):
+        retries = Retry(total=max_retries, connect=max_retries, read=0, status=0, redirect=None,
+                        backoff_factor=0.2, raise_on_status=False)
+        return HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                           max_retries=retries)
+
+    def create_session(self):
+        session = _Session(timeout=self.timeout)
+        for prefix, adapter in self._adapters.items():
+            session.mount(prefix, adapter)
+        return session
+
+    def close(self):
+        for adapter in self._adapters.values():
+            adapter.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport():
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
+
+
+def set_default_transport(transport):
+    # the transport of all instances without their own. size its pool_maxsize to the number of threads
+    # sending at the same time, urllib3 discards the connections beyond it ("Connection pool is full")
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
@@ -0,0 +1,123 @@
+import collections
+import itertools
+import re
+
+ValidationError = collections.namedtuple('ValidationError', ['row', 'field', 'message'])
+
+# the address lines on the back page are 60mm wide at 10pt, about 35 characters fit on a line
+ADDRESS_LINE_MAX_LENGTH = 35
+# the message box is 61x63mm at 10pt
+MESSAGE_MAX_LENGTH = 500
+
+SWISS_ZIP_CODE = re.compile(r'^[1-9][0-9]{3}$')
+# characters not allowed in xml 1.0 documents, escaping can not represent them
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+RECIPIENT_REQUIRED = ('prename', 'lastname', 'street', 'zip_code', 'place')
+RECIPIENT_OPTIONAL = ('company', 'company_addition', 'salutation')
+# fields rendered together on one line of the back page
+RECIPIENT_LINES = (('prename', 'lastname'), ('company', 'company_addition'), ('street',), ('zip_code', 'place'))
+
+SENDER_REQUIRED = ('prename', 'lastname', 'street', 'zip_code', 'place')
+SENDER_OPTIONAL = ('company', 'country')
+SENDER_LINES = (('prename', 'lastname'), ('company',), ('street',), ('zip_code', 'place'), ('country',))
+
+
+def _value(record, field):
+    value = record.get(field) if isinstance(record, dict) else getattr(record, field, None)
+    return '' if value is None else str(value).strip()
+
+
+def _batches(records, batch_size):
+    if isinstance(records, dict):
+        # columns of a table, e.g. {'prename': [...], 'lastname': [...]}
+        length = max([len(column) for column in records.values()] or [0])
+        columns = dict((field, list(column) + [None] * (length - len(column)))
+                       for field, column in records.items())
+        records = (dict((field, columns[field][i]) for field in columns) for i in range(length))
+
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _check_columns(columns, offset, required, lines, prefix, zip_code=True):
+    # columns: field -> list of values of a batch. checks run column by column
+    errors = []
+    for field in required:
+        for i, value in enumerate(columns[field]):
+            if not value:
+                errors.append(ValidationError(offset + i, prefix + field, 'is required'))
+
+    for field, values in columns.items():
+        for i, value in enumerate(values):
+            if INVALID_XML_CHARS.search(value):
+                errors.append(ValidationError(offset + i, prefix + field, 'contains characters not allowed in svg'))
+
+    if zip_code:
+        for i, value in enumerate(columns['zip_code']):
+            if value and not SWISS_ZIP_CODE.match(value):
+                errors.append(ValidationError(offset + i, prefix + 'zip_code', 'is not a swiss zip code'))
+
+    for line in lines:
+        lengths = [sum(len(columns[field][i]) for field in line) + len(line) - 1
+                   for i in range(len(columns[line[0]]))]
+        for i, length in enumerate(lengths):
+            if length > ADDRESS_LINE_MAX_LENGTH:
+                errors.append(ValidationError(offset + i, prefix + '+'.join(line),
+                                              'longer than {} characters'.format(ADDRESS_LINE_MAX_LENGTH)))
+    return errors
+
+
+def _validate(records, fields, required, lines, prefix, batch_size, zip_code=True):
+    offset = 0
+    for batch in _batches(records, batch_size):
+        columns = dict((field, [_value(record, field) for record in batch]) for field in fields)
+        for error in sorted(_check_columns(columns, offset, required, lines, prefix, zip_code)):
+            yield error
+        offset += len(batch)
+
+
+def validate_recipients(records, batch_size=10000):
+    """
+    Yields a ValidationError(row, field, message) for every problem in records.
+
+    records is an iterable of Recipient objects or dicts, or a dict of columns.
+    It is checked batch_size rows at a time, errors are ordered by row within a batch.
+    """
+    return _validate(records, RECIPIENT_REQUIRED + RECIPIENT_OPTIONAL, RECIPIENT_REQUIRED,
+                     RECIPIENT_LINES, '', batch_size)
+
+
+def validate_senders(records, batch_size=10000):
+    # senders may live abroad, their zip code is not checked
+    return _validate(records, SENDER_REQUIRED + SENDER_OPTIONAL, SENDER_REQUIRED,
+                     SENDER_LINES, '', batch_size, zip_code=False)
+
+
+def validate_postcards(postcards, batch_size=10000):
+    # checks recipient, sender and message of each postcard
+    offset = 0
+    for batch in _batches(postcards, batch_size):
+        errors = []
+        recipients = [p.recipient or {} for p in batch]
+        senders = [p.sender or {} for p in batch]
+        for error in _validate(recipients, RECIPIENT_REQUIRED + RECIPIENT_OPTIONAL, RECIPIENT_REQUIRED,
+                               RECIPIENT_LINES, 'recipient.', batch_size):
+            errors.append(error._replace(row=offset + error.row))
+        for error in _validate(senders, SENDER_REQUIRED + SENDER_OPTIONAL, SENDER_REQUIRED,
+                               SENDER_LINES, 'sender.', batch_size, zip_code=False):
+            errors.append(error._replace(row=offset + error.row))
+        for i, postcard in enumerate(batch):
+            message = postcard.message or ''
+            if len(message) > MESSAGE_MAX_LENGTH:
+                errors.append(ValidationError(offset + i, 'message',
+                                              'longer than {} characters'.format(MESSAGE_MAX_LENGTH)))
+            if INVALID_XML_CHARS.search(message):
+                errors.append(ValidationError(offset + i, 'message', 'contains characters not allowed in svg'))
+        for error in sorted(errors):
+            yield error
+        offset += len(batch)
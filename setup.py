@@ -47,11 +47,15 @@ setup(
         #   5 - Production/Stable
         # Indicate who your project is intended for
         'Intended Audience :: Developers',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
+    # asyncio.get_running_loop, datetime.fromisoformat and http.server.ThreadingHTTPServer
+    python_requires='>=3.7',
     setup_requires=['pytest-runner'],
     package_data={'postcard_creator': ['page_1.svg', 'page_2.svg']}
     # extras_require={
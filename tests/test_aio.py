@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from postcard_creator.aio import AsyncPostcardCreator, AsyncToken
+from tests import test_token as mocks
+
+
+def test_async_token_fetch_token():
+    mocks.create_token_with_successful_login()
+    token = AsyncToken(_protocol='mock://')
+
+    asyncio.run(token.fetch_token('username', 'password'))
+
+    assert token.token == 0
+    assert token.token_expires_in == 3600
+
+
+def test_async_send_free_card_concurrently():
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    clients = [AsyncPostcardCreator(token=pcc.token, _protocol='mock://') for _ in range(3)]
+
+    async def send_all():
+        return await asyncio.gather(*[c.send_free_card(mocks.create_postcard()) for c in clients])
+
+    responses = asyncio.run(send_all())
+
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert asyncio.run(clients[0].get_quota())['available']
+
+
+def test_async_client_does_not_forward_blocking_methods():
+    pcc = mocks.create_postcard_creator()
+    client = AsyncPostcardCreator(token=pcc.token, _protocol='mock://')
+
+    assert client.cache_ttl == client.sync.cache_ttl
+    with pytest.raises(AttributeError):
+        client._fetch_user_info
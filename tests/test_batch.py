@@ -0,0 +1,80 @@
+from io import BytesIO
+
+from postcard_creator.batch import fetch_tokens, send_batch
+from postcard_creator.postcard_creator import PostcardCreatorException, Token
+from tests import test_token as mocks
+
+
+def test_send_batch():
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    jobs = [(pcc.token, mocks.create_postcard()) for _ in range(5)]
+
+    results = list(send_batch(jobs, max_workers=2, mock_send=True, creator_kwargs={'_protocol': 'mock://'}))
+
+    assert len(results) == 5
+    assert all(not r.skipped and r.exception is None for r in results)
+    # all jobs share one account, the user is looked up once
+    paths = mocks.requested_paths(mocks.adapter_pcc)
+    assert paths.count(('GET', '/rest/2.1/users/current')) == 1
+
+
+def test_send_batch_skips_exhausted_accounts():
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints(available=False)
+    jobs = [(pcc.token, mocks.create_postcard()) for _ in range(3)]
+
+    results = list(send_batch(jobs, creator_kwargs={'_protocol': 'mock://'}))
+
+    assert all(r.skipped for r in results)
+    paths = mocks.requested_paths(mocks.adapter_pcc)
+    assert paths.count(('GET', '/rest/2.1/users/{}/quota'.format(mocks.USER_ID))) == 1
+
+
+def test_send_batch_reports_errors():
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    mocks.adapter_pcc.register_uri('POST', mocks.URL_PCC_HOST + '/users/{}/mailings'.format(mocks.USER_ID),
+                                   status_code=500, text='boom')
+
+    results = list(send_batch([(pcc.token, mocks.create_postcard())], creator_kwargs={'_protocol': 'mock://'}))
+
+    assert results[0].exception.server_response == 'boom'
+
+
+def test_send_batch_reports_corrupt_pictures():
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    corrupt = mocks.create_postcard()
+    corrupt.picture_stream = BytesIO(b'not an image')
+    jobs = [(pcc.token, mocks.create_postcard()), (pcc.token, corrupt), (pcc.token, mocks.create_postcard())]
+
+    results = list(send_batch(jobs, max_workers=1, mock_send=True, creator_kwargs={'_protocol': 'mock://'}))
+
+    assert len(results) == 3
+    failed = [r for r in results if r.exception is not None]
+    assert [r.job[1] for r in failed] == [corrupt]
+    assert not isinstance(failed[0].exception, PostcardCreatorException)
+
+
+def test_fetch_tokens():
+    mocks.create_token_with_successful_login()
+
+    results = list(fetch_tokens([('user1', 'password'), ('user2', 'password', 'post')], max_workers=2,
+                                _protocol='mock://'))
+
+    assert sorted(r.username for r in results) == ['user1', 'user2']
+    assert all(r.exception is None and r.token.token == 0 and r.token.idp == 'post' for r in results)
+
+
+def test_fetch_tokens_reports_any_error(monkeypatch):
+    mocks.create_token_with_successful_login()
+
+    def broken_login(self, session, username, password):
+        raise RuntimeError('unexpected login page')
+
+    monkeypatch.setattr(Token, '_get_saml_response', broken_login)
+    results = list(fetch_tokens([('user1', 'password'), ('user2', 'password')], _protocol='mock://'))
+
+    assert sorted(r.username for r in results) == ['user1', 'user2']
+    assert all(isinstance(r.exception, RuntimeError) for r in results)
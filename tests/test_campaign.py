@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+from postcard_creator.campaign import iter_postcards, load_recipients
+from postcard_creator.postcard_creator import Postcard, Recipient, Sender
+from tests import test_token as mocks
+
+ASSET = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'asset.jpg')
+
+
+def create_sender():
+    return Sender(prename='Anna', lastname='Muster', street='Street 1', zip_code=8000, place='Zurich')
+
+
+def test_objects_have_no_instance_dict():
+    recipient = Recipient(prename='a', lastname='b', street='c', zip_code=1000, place='d')
+    postcard = Postcard(sender=create_sender(), recipient=recipient, picture_stream=ASSET)
+    for obj in [recipient, create_sender(), postcard]:
+        assert not hasattr(obj, '__dict__')
+        with pytest.raises(AttributeError):
+            obj.unknown = 1
+
+
+def test_load_recipients_csv_and_jsonl(tmpdir):
+    csv_file = tmpdir.join('recipients.csv')
+    csv_file.write_text('prename,lastname,street,zip_code,place\nHans,Meier,Street 2,3000,Bern\n'
+                   'Eva,Müller,Street 3,4000,Basel\n', encoding='utf-8')
+    jsonl_file = tmpdir.join('recipients.jsonl')
+    jsonl_file.write_text('\n'.join(json.dumps({'prename': p, 'lastname': 'Meier', 'street': 's', 'zip_code': '3000',
+                                           'place': 'Bern', 'company': 'ACME'}) for p in ['Hans', 'Eva']),
+                     encoding='utf-8')
+
+    from_csv = list(load_recipients(str(csv_file)))
+    from_jsonl = list(load_recipients(str(jsonl_file)))
+
+    assert [r.prename for r in from_csv] == ['Hans', 'Eva']
+    assert from_csv[1].lastname == 'Müller'
+    assert from_csv[0].company == ''
+    assert [r.prename for r in from_jsonl] == ['Hans', 'Eva']
+    assert from_jsonl[0].company == 'ACME'
+
+
+def test_send_postcard_with_picture_path():
+    sender = create_sender()
+    recipients = [Recipient(prename='Hans', lastname='Meier', street='Street 2', zip_code=3000, place='Bern')]
+    postcard = next(iter_postcards(sender, recipients, ASSET, message='hi'))
+    assert postcard.sender is sender
+
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    assert pcc.send_free_card(postcard).status_code == 200
@@ -0,0 +1,130 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from postcard_creator.cache import AssetCache, DiskImageCache, ImageCache
+from postcard_creator.imaging import ImageProcessor, rotate_and_scale_image
+from tests import test_token as mocks
+
+ASSET = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'asset.jpg')
+
+
+def test_rotate_and_scale_image_accepts_bytes_and_paths():
+    with open(ASSET, 'rb') as f:
+        from_bytes = rotate_and_scale_image(f.read())
+    from_path = rotate_and_scale_image(ASSET)
+
+    assert from_bytes == from_path
+    with Image.open(BytesIO(from_path)) as image:
+        assert image.width > image.height
+
+
+def test_image_processor_map_keeps_order():
+    sizes = [(400, 300), (300, 400), (800, 600)]
+    images = []
+    for size in sizes:
+        with BytesIO() as f:
+            Image.new('RGB', size).save(f, 'JPEG')
+            images.append(f.getvalue())
+
+    with ImageProcessor(max_workers=2) as processor:
+        scaled = list(processor.map(images, window=2, image_rotate=False))
+
+    heights = [Image.open(BytesIO(data)).height for data in scaled]
+    assert heights == [222, 111, 555]
+
+
+def test_pcc_send_free_card_with_image_processor():
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+
+    with ImageProcessor(max_workers=1) as processor:
+        pcc.image_processor = processor
+        response = pcc.send_free_card(mocks.create_postcard())
+
+    assert response.status_code == 200
+
+
+def test_fast_path_matches_default_path():
+    for size in [(4000, 3000), (3000, 4000), (500, 300)]:
+        with BytesIO() as f:
+            Image.new('RGB', size, color=(200, 10, 10)).save(f, 'JPEG')
+            data = f.getvalue()
+
+        default = Image.open(BytesIO(rotate_and_scale_image(data)))
+        fast = Image.open(BytesIO(rotate_and_scale_image(data, image_fast=True)))
+        assert fast.size == default.size
+        assert fast.getpixel((10, 10)) == default.getpixel((10, 10))
+
+
+def test_output_format():
+    jpeg = rotate_and_scale_image(ASSET, image_fast=True, image_format='jpeg', image_quality=80)
+    assert Image.open(BytesIO(jpeg)).format == 'JPEG'
+
+
+def test_pcc_upload_mime_type_matches_format():
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+
+    pcc.send_free_card(mocks.create_postcard(), image_fast=True, image_format='JPEG')
+
+    upload = [r for r in mocks.adapter_pcc.request_history if r.path.endswith('/assets')][0]
+    filename, _, mime_type = dict(upload.body.fields)['asset']
+    assert (filename, mime_type) == ('asset.jpg', 'image/jpeg')
+    assert upload.headers['Content-Type'].startswith('multipart/form-data; boundary=')
+
+
+def test_image_cache_lru_eviction(tmpdir):
+    for cache in [ImageCache(max_bytes=10), DiskImageCache(str(tmpdir), max_bytes=10)]:
+        cache.set('a', b'12345')
+        cache.set('b', b'12345')
+        assert cache.get('a') == b'12345'
+        cache.set('c', b'12345')
+
+        assert cache.get('c') == b'12345'
+        assert cache.size == 10
+        assert sum(cache.get(key) is not None for key in 'abc') == 2
+
+
+def test_pcc_send_free_card_reuses_processed_image_and_asset():
+    image_cache = ImageCache()
+    asset_cache = AssetCache()
+
+    for _ in range(2):
+        pcc = mocks.create_postcard_creator()
+        mocks.register_pcc_endpoints()
+        pcc.image_cache = image_cache
+        pcc.asset_cache = asset_cache
+        pcc.send_free_card(mocks.create_postcard())
+
+    paths = mocks.requested_paths(mocks.adapter_pcc)
+    assert ('POST', '/rest/2.1/users/{}/assets'.format(mocks.USER_ID)) not in paths
+    page_1 = [r for r in mocks.adapter_pcc.request_history if r.path.endswith('/pages/1')][0]
+    assert mocks.ASSET_ID in page_1.text
+    assert image_cache.hits == 1
+    assert asset_cache.hits == 1
+
+
+def encode(size, image_format):
+    with BytesIO() as f:
+        Image.new('RGB', size, 'white').save(f, image_format)
+        return f.getvalue()
+
+
+def test_max_pixels_decodes_jpeg_at_reduced_scale():
+    data = encode((6160, 4440), 'JPEG')
+
+    bounded = rotate_and_scale_image(data, image_quality_factor=5, image_max_pixels=2000 * 1000)
+
+    with Image.open(BytesIO(bounded)) as image:
+        assert image.size == (770, 555)
+
+
+def test_max_pixels_refuses_large_images():
+    data = encode((3000, 2000), 'PNG')
+
+    with pytest.raises(ValueError):
+        rotate_and_scale_image(data, image_max_pixels=1000 * 1000)
+    assert rotate_and_scale_image(data, image_fast=True, image_max_pixels=3000 * 2000)
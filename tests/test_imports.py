@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = ['PIL', 'bs4', 'resizeimage', 'requests_toolbelt', 'pkg_resources']
+
+
+def imported_modules(statement):
+    code = '{}\nimport sys\nprint(" ".join(sys.modules))'.format(statement)
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return set(output.decode('utf-8').split())
+
+
+def test_import_does_not_load_heavy_dependencies():
+    modules = imported_modules('import postcard_creator.postcard_creator')
+    assert modules.isdisjoint(HEAVY_MODULES)
+
+
+def test_svg_rendering_does_not_load_heavy_dependencies():
+    modules = imported_modules(
+        'from postcard_creator.postcard_creator import Postcard, Recipient, Sender\n'
+        'sender = Sender("Anna", "Muster", "Street 1", 8000, "Zürich")\n'
+        'recipient = Recipient("Hans", "Meier", "Street 2", 3000, "Bern")\n'
+        'Postcard(sender, recipient, None, "Hoi").get_backpage()')
+    assert modules.isdisjoint(HEAVY_MODULES)
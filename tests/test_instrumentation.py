@@ -0,0 +1,83 @@
+import logging
+
+from postcard_creator.instrumentation import Histogram, Instrumentation, endpoint_name, instrumentation
+from postcard_creator.postcard_creator import LOGGING_TRACE_LVL, TRACE_BODY_LIMIT, _format_body
+from tests import test_token as mocks
+
+
+def test_endpoint_name_replaces_ids():
+    assert endpoint_name('post', '/users/1381204/mailings/28661786/order') == \
+        'POST /users/{id}/mailings/{id}/order'
+    assert endpoint_name('GET', '/users/current/quota') == 'GET /users/current/quota'
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in [0.05, 0.05, 0.5, 5]:
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == float('inf')
+
+
+def test_disabled_records_nothing():
+    stats = Instrumentation()
+    assert not stats.active
+    stats.record('request', 'GET /users/current', 0.1, status=200)
+    assert stats.snapshot() == {}
+
+
+def test_send_free_card_instrumented():
+    events = []
+    instrumentation.add_hook(events.append)
+    instrumentation.enable()
+    try:
+        pcc = mocks.create_postcard_creator()
+        mocks.register_pcc_endpoints()
+        pcc.send_free_card(mocks.create_postcard(), mock_send=True)
+        snapshot = instrumentation.snapshot()
+    finally:
+        instrumentation.disable()
+        instrumentation.remove_hook(events.append)
+        instrumentation.reset()
+
+    names = [(event.kind, event.name) for event in events]
+    assert ('request', 'POST /users/{id}/mailings') in names
+    assert ('request', 'POST /users/{id}/assets') in names
+    assert ('image', 'rotate_and_scale') in names
+    upload = snapshot[('request', 'POST /users/{id}/assets')]
+    assert upload['count'] == 1
+    assert upload['bytes_sent'] > 0
+
+
+def test_login_instrumented():
+    events = []
+    instrumentation.add_hook(events.append)
+    try:
+        token = mocks.create_token_with_successful_login()
+        token.fetch_token('username', 'password')
+    finally:
+        instrumentation.remove_hook(events.append)
+
+    assert [(event.kind, event.name, event.status) for event in events] == \
+        [('login', 'post', 'ok'), ('login', 'sso', 'ok')]
+
+
+def test_trace_body_truncated():
+    text = _format_body(b'x' * (TRACE_BODY_LIMIT + 10))
+    assert text.endswith('... (10 more bytes)')
+    assert _format_body(None) == ''
+
+
+def test_trace_skipped_below_trace_level(monkeypatch):
+    logger = logging.getLogger('postcard_creator')
+    monkeypatch.setattr(logger, 'level', LOGGING_TRACE_LVL + 5)
+    calls = []
+    monkeypatch.setattr('postcard_creator.postcard_creator._format_body', lambda body: calls.append(body))
+
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    pcc.get_user_info()
+
+    assert calls == []
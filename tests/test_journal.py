@@ -0,0 +1,53 @@
+import pytest
+
+from postcard_creator.journal import SendJournal
+from postcard_creator.postcard_creator import PostcardCreatorException
+from tests import test_token as mocks
+
+URL_MAILING = mocks.URL_PCC_HOST + '/users/{}/mailings/{}'.format(mocks.USER_ID, mocks.MAILING_ID)
+
+
+def count(method, suffix):
+    return len([r for r in mocks.adapter_pcc.request_history if r.method == method and r.path.endswith(suffix)])
+
+
+def test_journaled_send_resumes_after_failure(tmpdir):
+    journal = SendJournal(str(tmpdir.join('journal.sqlite')))
+    pcc = mocks.create_postcard_creator()
+    pcc.journal = journal
+    mocks.register_pcc_endpoints()
+    mocks.adapter_pcc.register_uri('PUT', URL_MAILING + '/pages/2', status_code=400)
+
+    with pytest.raises(PostcardCreatorException):
+        pcc.send_free_card(mocks.create_postcard(), idempotency_key='card-1')
+    entry = journal.get('card-1')
+    assert entry['card_id'] == str(mocks.MAILING_ID)
+    assert entry['asset_id'] == mocks.ASSET_ID
+    assert entry['recipient_set'] and not entry['pages_set']
+
+    mocks.adapter_pcc.register_uri('PUT', URL_MAILING + '/pages/2', status_code=204)
+    mocks.adapter_pcc.request_history.clear()
+    response = pcc.send_free_card(mocks.create_postcard(), idempotency_key='card-1')
+
+    assert response.status_code == 200
+    assert count('POST', '/mailings') == 0
+    assert count('POST', '/assets') == 0
+    assert count('PUT', '/recipients') == 0
+    assert count('PUT', '/pages/1') == 1
+    assert count('POST', '/order') == 1
+
+    mocks.adapter_pcc.request_history.clear()
+    assert pcc.send_free_card(mocks.create_postcard(), idempotency_key='card-1') is None
+    assert mocks.adapter_pcc.call_count == 0
+
+
+def test_journaled_send_does_not_repeat_interrupted_order(tmpdir):
+    journal = SendJournal(str(tmpdir.join('journal.sqlite')))
+    journal.update('card-1', user_id=str(mocks.USER_ID), card_id='1', order_started=True)
+    pcc = mocks.create_postcard_creator()
+    pcc.journal = journal
+    mocks.register_pcc_endpoints()
+
+    with pytest.raises(PostcardCreatorException):
+        pcc.send_free_card(mocks.create_postcard(), idempotency_key='card-1')
+    assert count('POST', '/order') == 0
@@ -0,0 +1,47 @@
+import requests
+
+from postcard_creator.instrumentation import Event
+from postcard_creator.metrics import CONTENT_TYPE, Metrics
+from tests import test_token as mocks
+
+
+def test_generate_openmetrics():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.observe(Event('request', 'GET /users/current', 0.05, 200, 0, 120))
+    metrics.observe(Event('request', 'GET /users/current', 0.5, 200, 0, 120))
+    metrics.observe(Event('login', 'swissid', 1.5, 'ok', 0, 0))
+    metrics.observe(Event('cache', 'quota', 0.0, 'hit', 0, 0))
+    metrics.observe(Event('quota', '1381204', 0.0, 'exhausted', 0, 0))
+
+    text = metrics.generate()
+    lines = text.splitlines()
+    assert 'pcc_requests_total{endpoint="GET /users/current",status="200"} 2' in lines
+    assert 'pcc_request_duration_seconds_bucket{endpoint="GET /users/current",le="0.1"} 1' in lines
+    assert 'pcc_request_duration_seconds_bucket{endpoint="GET /users/current",le="+Inf"} 2' in lines
+    assert 'pcc_request_duration_seconds_count{endpoint="GET /users/current"} 2' in lines
+    assert 'pcc_request_received_bytes_total{endpoint="GET /users/current"} 240' in lines
+    assert 'pcc_logins_total{idp="swissid",outcome="ok"} 1' in lines
+    assert 'pcc_cache_lookups_total{cache="quota",result="hit"} 1' in lines
+    assert 'pcc_quota_available{user_id="1381204"} 0' in lines
+    assert '# TYPE pcc_requests counter' in lines
+    assert lines[-1] == '# EOF'
+
+
+def test_send_free_card_metrics_served():
+    metrics = Metrics().install()
+    try:
+        pcc = mocks.create_postcard_creator()
+        mocks.register_pcc_endpoints()
+        pcc.send_free_card(mocks.create_postcard(), mock_send=True)
+    finally:
+        metrics.uninstall()
+
+    with metrics.serve(port=0) as server:
+        response = requests.get('http://127.0.0.1:{}/metrics'.format(server.port))
+
+    assert response.headers['Content-Type'] == CONTENT_TYPE
+    lines = response.text.splitlines()
+    assert 'pcc_requests_total{endpoint="POST /users/{id}/mailings",status="201"} 1' in lines
+    assert 'pcc_quota_available{user_id="1381204"} 1' in lines
+    assert 'pcc_image_size_bytes_count 1' in lines
+    assert 'pcc_cache_lookups_total{cache="user",result="miss"} 1' in lines
@@ -0,0 +1,128 @@
+import concurrent.futures
+import copy
+import datetime
+import threading
+
+import pytest
+
+from postcard_creator.pool import AccountPool, parse_quota_next
+from postcard_creator.postcard_creator import PostcardCreatorException
+from tests import test_token as mocks
+
+QUOTA_PATH = ('GET', '/rest/2.1/users/{}/quota'.format(mocks.USER_ID))
+RESET = datetime.datetime(2017, 7, 29, tzinfo=datetime.timezone.utc)
+
+
+def create_pool(count=2, now=RESET - datetime.timedelta(hours=1)):
+    pcc = mocks.create_postcard_creator()
+    clock = [now]
+    pool = AccountPool([copy.copy(pcc.token) for _ in range(count)], creator_kwargs={'_protocol': 'mock://'},
+                       clock=lambda: clock[0])
+    return pool, clock
+
+
+def test_pool_sends_from_accounts_in_turn():
+    pool, _ = create_pool()
+    mocks.register_pcc_endpoints()
+
+    creators = []
+    for _ in range(3):
+        with pool.account() as creator:
+            creators.append(creator)
+            creator.send_free_card(mocks.create_postcard(), mock_send=True)
+
+    assert creators[0] is not creators[1]
+    assert creators[0] is creators[2]
+    assert pool.capacity() == 2
+    assert pool.next_available() == RESET - datetime.timedelta(hours=1)
+
+
+def test_pool_waits_for_busy_accounts():
+    pool, _ = create_pool(count=2)
+    mocks.register_pcc_endpoints()
+
+    active = []
+    lock = threading.Lock()
+
+    def send(i):
+        with pool.account() as creator:
+            with lock:
+                assert creator not in active
+                active.append(creator)
+            try:
+                return creator.send_free_card(mocks.create_postcard(), mock_send=True)
+            finally:
+                with lock:
+                    active.remove(creator)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(send, range(12)))
+
+    assert results == [False] * 12
+
+
+def test_pool_busy_timeout():
+    pool, _ = create_pool(count=1)
+    mocks.register_pcc_endpoints()
+    account = pool.acquire()
+
+    with pytest.raises(PostcardCreatorException, match='busy'):
+        with pool.account(timeout=0.05):
+            pass
+
+    threading.Timer(0.05, pool.release, [account]).start()
+    with pool.account(timeout=5) as creator:
+        assert creator is account.creator
+
+
+def test_pool_does_not_poll_exhausted_accounts():
+    pool, clock = create_pool()
+    mocks.register_pcc_endpoints(available=False)
+
+    with pytest.raises(PostcardCreatorException):
+        pool.send_free_card(mocks.create_postcard())
+    with pytest.raises(PostcardCreatorException):
+        pool.send_free_card(mocks.create_postcard())
+
+    assert mocks.requested_paths(mocks.adapter_pcc).count(QUOTA_PATH) == 2
+    assert pool.capacity() == 0
+    assert pool.capacity(at=RESET) == 2
+    assert pool.next_available() == RESET
+    assert pool.schedule() == [(RESET, 2)]
+
+    # accounts are asked again once their quota was reset
+    clock[0] = RESET
+    pool.refresh()
+    assert mocks.requested_paths(mocks.adapter_pcc).count(QUOTA_PATH) == 4
+
+
+def test_pool_backs_off_when_reset_has_passed():
+    pool, clock = create_pool(count=1, now=RESET + datetime.timedelta(seconds=5))
+    mocks.register_pcc_endpoints(available=False)
+
+    with pytest.raises(PostcardCreatorException):
+        pool.send_free_card(mocks.create_postcard())
+
+    assert mocks.requested_paths(mocks.adapter_pcc).count(QUOTA_PATH) == 1
+    assert pool.capacity() == 0
+    assert pool.next_available() == clock[0] + datetime.timedelta(seconds=pool.min_backoff)
+
+
+def test_empty_pool():
+    pool = AccountPool()
+
+    assert pool.capacity() == 0
+    assert pool.next_available() is None
+    with pytest.raises(PostcardCreatorException):
+        pool.send_free_card(mocks.create_postcard())
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2017-07-29', RESET),
+    ('2017-07-29T00:00:00Z', RESET),
+    ('2017-07-29T02:00:00.000+0200', RESET),
+    ('tomorrow', None),
+    (None, None),
+])
+def test_parse_quota_next(value, expected):
+    assert parse_quota_next(value) == expected
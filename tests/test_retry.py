@@ -0,0 +1,79 @@
+import email.utils
+import time
+
+import pytest
+
+from postcard_creator.postcard_creator import PostcardCreatorException
+from postcard_creator.retry import RateLimiter, RetryPolicy, parse_retry_after
+from tests import test_token as mocks
+
+URL_MAILINGS = mocks.URL_PCC_HOST + '/users/{}/mailings'.format(mocks.USER_ID)
+PATH_MAILINGS = '/rest/2.1/users/{}/mailings'.format(mocks.USER_ID)
+
+
+def create_postcard_creator():
+    pcc = mocks.create_postcard_creator()
+    pcc.retry_policy = RetryPolicy(backoff=0)
+    mocks.register_pcc_endpoints()
+    return pcc
+
+
+def test_retry_after_throttling():
+    pcc = create_postcard_creator()
+    mocks.adapter_pcc.register_uri('POST', URL_MAILINGS, [
+        {'status_code': 429, 'headers': {'Retry-After': '0'}},
+        {'status_code': 201, 'headers': {'Location': '/mailings/{}'.format(mocks.MAILING_ID)}}
+    ])
+
+    pcc.send_free_card(mocks.create_postcard(), mock_send=True)
+
+    assert mocks.requested_paths(mocks.adapter_pcc).count(('POST', PATH_MAILINGS)) == 2
+
+
+def test_no_retry_of_non_idempotent_server_errors():
+    pcc = create_postcard_creator()
+    mocks.adapter_pcc.register_uri('POST', URL_MAILINGS, status_code=502)
+
+    with pytest.raises(PostcardCreatorException):
+        pcc.send_free_card(mocks.create_postcard())
+    assert mocks.requested_paths(mocks.adapter_pcc).count(('POST', PATH_MAILINGS)) == 1
+
+
+def test_retry_idempotent_requests_until_max_attempts():
+    pcc = create_postcard_creator()
+    mocks.adapter_pcc.register_uri('GET', mocks.URL_PCC_HOST + '/users/current', status_code=502)
+
+    with pytest.raises(PostcardCreatorException):
+        pcc.get_user_info()
+    assert len(mocks.adapter_pcc.request_history) == 4
+
+
+def test_upload_body_recreated_on_retry():
+    pcc = create_postcard_creator()
+    url_assets = mocks.URL_PCC_HOST + '/users/{}/assets'.format(mocks.USER_ID)
+    mocks.adapter_pcc.register_uri('POST', url_assets, [
+        {'status_code': 503},
+        {'status_code': 201, 'headers': {'Location': '/assets/user/{}'.format(mocks.ASSET_ID)}}
+    ])
+
+    pcc.send_free_card(mocks.create_postcard(), mock_send=True)
+
+    uploads = [r for r in mocks.adapter_pcc.request_history if r.path.endswith('/assets')]
+    assert len(uploads) == 2
+    assert uploads[0].body is not uploads[1].body
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('garbage') is None
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < parse_retry_after(date) <= 30
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.05
@@ -0,0 +1,47 @@
+import pkg_resources
+import pytest
+from bs4 import BeautifulSoup
+
+from postcard_creator.postcard_creator import _extract_saml_response
+
+
+def beautifulsoup_saml_response(html):
+    saml_response = BeautifulSoup(html, 'html.parser').find('input', {'name': 'SAMLResponse'})
+    return saml_response.get('value') if saml_response is not None else None
+
+
+FIXTURES = [
+    pkg_resources.resource_string(__name__, 'saml_response.html').decode('utf-8'),
+    pkg_resources.resource_string(__name__, 'saml_response_invalid.html').decode('utf-8'),
+    '<input type="hidden" name="SAMLResponse" value="abc"/>',
+    "<INPUT VALUE='a&amp;b' NAME='SAMLResponse'>",
+    '<input name=SAMLResponse value=abc>',
+    '<input\n  name="SAMLResponse"\n  value="multi&#10;line"\n/>',
+    '<input data-name="SAMLResponse" value="wrong"><input name="SAMLResponse" value="right">',
+    '<input name="SAMLResponseX" value="wrong">',
+    '<input name="samlresponse" value="wrong">',
+    '<input name="SAMLResponse">',
+    '<input name="SAMLResponse" value="">',
+    '<input title="a>b" name="SAMLResponse" value="fallback">',
+    '<input name="SAMLResponse" value="abc>def">',
+    '<input data-x=" value=evil" name="SAMLResponse" value="good">',
+    '<!-- <input name="SAMLResponse" value="old"> --><input name="SAMLResponse" value="new">',
+    '<div title="<input name=SAMLResponse value=evil>"></div><input name="SAMLResponse" value="good">',
+    '<script>var s = \'<input name="SAMLResponse" value="evil">\';</script><input name="SAMLResponse" value="good">',
+    '<input name="SAMLResponse" value="first" value="second">',
+    '<input name="SAMLResponse"value="no space">',
+    '<input name="SAMLResponse" value=a&amp;b/>',
+    '<input name="SAMLResponse" value>',
+    '<!-- <input name="SAMLResponse" value="unclosed">',
+    '',
+]
+
+
+@pytest.mark.parametrize('html', FIXTURES)
+def test_extract_saml_response_matches_beautifulsoup(html):
+    assert _extract_saml_response(html) == beautifulsoup_saml_response(html)
+
+
+def test_extract_saml_response_fixture():
+    assert _extract_saml_response(FIXTURES[0]).startswith('PD94bWwgdmVyc2lvbj0xLjAg')
+    assert _extract_saml_response(FIXTURES[1]) is None
@@ -0,0 +1,105 @@
+import os
+
+import requests
+
+from postcard_creator.spool import PreparedCard, prepare_cards, read_card, spooled_cards, submit_spool, write_card
+from tests import test_token as mocks
+
+PICTURE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'asset.jpg')
+
+
+def create_postcards(count):
+    postcards = []
+    for i in range(count):
+        postcard = mocks.create_postcard()
+        postcard.picture_stream.close()
+        postcard.picture_stream = PICTURE
+        postcard.recipient.prename = 'Hans {}'.format(i)
+        postcards.append(postcard)
+    return postcards
+
+
+def test_card_file_round_trip(tmpdir):
+    path = str(tmpdir.join('card.card'))
+    card = PreparedCard(b'\x89PNG', 'PNG', '<svg>{asset_id}</svg>', '<svg>Grüezi</svg>', {'recipients': [['a']]})
+    write_card(path, card)
+
+    read = read_card(path)
+    assert read.image == b'\x89PNG'
+    assert read.image_format == 'PNG'
+    assert read.get_frontpage('asset') == '<svg>asset</svg>'
+    assert read.page_2 == '<svg>Grüezi</svg>'
+    assert read.recipient == {'recipients': [['a']]}
+    read.close()
+
+
+def test_prepare_cards(tmpdir):
+    directory = str(tmpdir.join('spool'))
+    postcards = create_postcards(3)
+
+    paths = list(prepare_cards(postcards, directory, image_format='JPEG'))
+
+    assert paths == spooled_cards(directory)
+    card = read_card(paths[1])
+    assert card.image_format == 'JPEG'
+    assert card.page_2 == postcards[1].get_backpage()
+    assert card.get_frontpage('asset') == postcards[1].get_frontpage(asset_id='asset')
+    assert card.recipient == postcards[1].recipient.to_json()
+
+    # prepared cards are not prepared again
+    assert list(prepare_cards(postcards, directory, image_format='JPEG')) == []
+
+
+def test_submit_spool(tmpdir):
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    directory = str(tmpdir.join('spool'))
+    list(prepare_cards(create_postcards(2), directory))
+
+    results = list(submit_spool(pcc, directory))
+
+    assert all(r.exception is None and r.response.status_code == 200 for r in results)
+    assert spooled_cards(directory) == []
+    pages = [r for r in mocks.adapter_pcc.request_history if r.path.endswith('/pages/1')]
+    assert all(mocks.ASSET_ID in page.text for page in pages)
+    assert list(prepare_cards(create_postcards(2), directory)) == []
+
+
+def test_submit_spool_keeps_interrupted_orders(tmpdir):
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    url_order = mocks.URL_PCC_HOST + '/users/{}/mailings/{}/order'.format(mocks.USER_ID, mocks.MAILING_ID)
+    mocks.adapter_pcc.register_uri('POST', url_order, exc=requests.exceptions.ConnectionError)
+    directory = str(tmpdir.join('spool'))
+    list(prepare_cards(create_postcards(1), directory))
+
+    result, = submit_spool(pcc, directory)
+
+    # the card may have been ordered, it is neither sent again nor prepared again
+    assert isinstance(result.exception, requests.exceptions.ConnectionError)
+    assert sorted(os.listdir(directory)) == ['00000000.ordering']
+    assert list(submit_spool(pcc, directory)) == []
+    assert list(prepare_cards(create_postcards(1), directory)) == []
+
+    mocks.register_pcc_endpoints()
+    result, = submit_spool(pcc, directory, resend_ordering=True)
+    assert result.exception is None
+    assert sorted(os.listdir(directory)) == ['00000000.sent']
+
+
+def test_submit_spool_rejected_order_is_sent_again(tmpdir):
+    pcc = mocks.create_postcard_creator()
+    mocks.register_pcc_endpoints()
+    url_order = mocks.URL_PCC_HOST + '/users/{}/mailings/{}/order'.format(mocks.USER_ID, mocks.MAILING_ID)
+    mocks.adapter_pcc.register_uri('POST', url_order, text='{}', status_code=400)
+    directory = str(tmpdir.join('spool'))
+    list(prepare_cards(create_postcards(1), directory))
+
+    result, = submit_spool(pcc, directory)
+
+    assert result.exception is not None
+    assert sorted(os.listdir(directory)) == ['00000000.card']
+
+
+def test_prepare_cards_docstring():
+    assert 'card file' in prepare_cards.__doc__
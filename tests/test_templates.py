@@ -0,0 +1,66 @@
+from postcard_creator.postcard_creator import Postcard, Recipient, Sender
+from postcard_creator.templates import backpage_template, escape_svg, render_pages
+
+
+def create_postcard(prename='Hans', message='Grüezi'):
+    sender = Sender(prename='Anna', lastname='Muster', street='Street 1', zip_code=8000, place='Zürich',
+                    company='A & B')
+    recipient = Recipient(prename=prename, lastname='Meier', street='Street 2', zip_code=3000, place='Bern')
+    return Postcard(sender=sender, recipient=recipient, picture_stream=None, message=message)
+
+
+def test_backpage_matches_layout_replace():
+    postcard = create_postcard()
+    expected = postcard.backpage_layout \
+        .replace('{first_name}', 'Hans') \
+        .replace('{last_name}', 'Meier') \
+        .replace('{company}', '') \
+        .replace('{company_addition}', '') \
+        .replace('{street}', 'Street 2') \
+        .replace('{zip_code}', '3000') \
+        .replace('{place}', 'Bern') \
+        .replace('{sender_company}', 'A &amp; B') \
+        .replace('{sender_name}', 'Anna Muster') \
+        .replace('{sender_address}', 'Street 1') \
+        .replace('{sender_zip_code}', '8000') \
+        .replace('{sender_place}', 'Z&#252;rich') \
+        .replace('{sender_country}', '') \
+        .replace('{message}', 'Gr&#252;ezi')
+
+    assert postcard.get_backpage() == expected
+    assert postcard.get_frontpage(asset_id=42) == postcard.frontpage_layout.replace('{asset_id}', '42')
+
+
+def test_all_fields_escaped():
+    assert escape_svg('<b>&"é') == '&lt;b&gt;&amp;"&#233;'
+    assert escape_svg(None) == ''
+    backpage = create_postcard(prename='<script>').get_backpage()
+    assert '<script>' not in backpage
+
+
+def test_templates_loaded_once():
+    assert backpage_template() is backpage_template()
+    assert create_postcard().backpage_layout is create_postcard().backpage_layout
+
+
+def test_render_pages():
+    postcards = [create_postcard(prename='P{}'.format(i)) for i in range(3)]
+    pages = list(render_pages(postcards, asset_id='asset'))
+
+    assert [back for _, back in pages] == [p.get_backpage() for p in postcards]
+    assert all(front == postcards[0].get_frontpage('asset') for front, _ in pages)
+
+
+def test_custom_layout():
+    postcard = create_postcard()
+    postcard.frontpage_layout = '<svg>{asset_id}</svg>'
+    postcard.backpage_layout = '<svg>{first_name}: {message}</svg>'
+
+    assert postcard.get_frontpage(asset_id=42) == '<svg>42</svg>'
+    assert postcard.get_backpage() == '<svg>Hans: Gr&#252;ezi</svg>'
+    assert list(render_pages([postcard, create_postcard()], asset_id='asset'))[0] == \
+        ('<svg>asset</svg>', '<svg>Hans: Gr&#252;ezi</svg>')
+    assert create_postcard().backpage_layout == backpage_template().text
+
+    postcard.backpage_layout = None
+    assert postcard.get_backpage() == create_postcard().get_backpage()
@@ -1,11 +1,13 @@
 from postcard_creator.postcard_creator import PostcardCreator, Token, Postcard, Sender, Recipient, \
     PostcardCreatorException
+from postcard_creator.cache import MemoryTokenCache, FileTokenCache, token_cache_key
 import requests
 import requests_mock
 import logging
 import pkg_resources
 import json
 import pytest
+import tempfile
 import os
 
 logging.basicConfig(level=logging.INFO,
@@ -27,6 +29,13 @@ def create_mocked_session(self):
     return session
 
 
+def create_mocked_pcc_session(self):
+    global adapter_pcc
+    session = requests.Session()
+    session.mount('mock', adapter_pcc)
+    return session
+
+
 def create_token():
     global adapter_token
     adapter_token = requests_mock.Adapter()
@@ -37,7 +46,7 @@ def create_token():
 def create_postcard_creator():
     global adapter_pcc
     adapter_pcc = requests_mock.Adapter()
-    PostcardCreator._create_session = create_mocked_session
+    PostcardCreator._create_session = create_mocked_pcc_session
     token = create_token()
     token.token_expires_in = 3600
     token.token_type = 'Bearer'
@@ -76,6 +85,14 @@ def test_token_wrong_user_credentials():
         token.fetch_token('username', 'password')
 
 
+def test_token_has_valid_credentials_false_when_both_flows_fail():
+    token = create_token()
+    adapter_token.register_uri('GET', URL_TOKEN_SAML, text='', reason='', status_code=500)
+    adapter_token.register_uri('POST', URL_TOKEN_SAML, reason='', text='')
+
+    assert token.has_valid_credentials('username', 'password') is False
+
+
 def test_token_saml_invalid_response():
     token = create_token_with_successful_login()
     saml_response = pkg_resources.resource_string(__name__, 'saml_response_invalid.html').decode('utf-8')
@@ -107,10 +124,7 @@ def test_token_has_valid_credential():
     assert token.has_valid_credentials('username', 'password')
 
 
-def test_pcc_send_free_card_successful():
-
-    # work in progress
-    pcc = create_postcard_creator()
+def create_postcard():
     sender = Sender(prename='prename',
                     lastname='lastname',
                     street='My street 11',
@@ -124,15 +138,21 @@ def test_pcc_send_free_card_successful():
                           zip_code=8000)
 
     file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'asset.jpg')
-    postcard = Postcard(sender=sender,
-                        recipient=recipient,
-                        picture_stream=open(file, 'rb'),
-                        message='Coding rocks!')
+    return Postcard(sender=sender,
+                    recipient=recipient,
+                    picture_stream=open(file, 'rb'),
+                    message='Coding rocks!')
+
+
+USER_ID = 1381204
+MAILING_ID = 28661786
+ASSET_ID = 'b12c8ee1-5cd6-4ba4-9d5c-1a7e8c5d6f00'
 
-    userId = 1381204
+
+def register_pcc_endpoints(available=True):
     user = {
         'tenantId': 'CHE',
-        'userId': userId,
+        'userId': USER_ID,
         'email': 'hi@foo.ch',
         'sex': 'FEMALE',
         'givenName': 'Kukka',
@@ -146,15 +166,17 @@ def test_pcc_send_free_card_successful():
         'gtcAccepted': True
     }
     quota = {
-        'available': True,
+        'available': available,
         'next': '2017-07-29',
         'quota': -1,
         'retentionDays': 1
 
     }
-    mailingId = 28661786
     mailing_headers = {
-        'Location': 'https://postcardcreator.post.ch/rest/2.1/users/{}/mailings/{}'.format(userId, mailingId)
+        'Location': 'https://postcardcreator.post.ch/rest/2.1/users/{}/mailings/{}'.format(USER_ID, MAILING_ID)
+    }
+    asset_headers = {
+        'Location': 'https://postcardcreator.post.ch/rest/2.1/users/{}/assets/user/{}'.format(USER_ID, ASSET_ID)
     }
 
     mailings = {
@@ -163,13 +185,247 @@ def test_pcc_send_free_card_successful():
         'paid': False
     }
 
-    URL_USERS_CURRENT = URL_PCC_HOST + '/users/current'
-    URL_USERS_QUOTA = URL_PCC_HOST + '/users/{}/quota'.format(userId)
-    URL_USERS_MAILINGS = URL_PCC_HOST + '/users/{}/mailings'.format(userId)
+    url_mailing = URL_PCC_HOST + '/users/{}/mailings/{}'.format(USER_ID, MAILING_ID)
+    adapter_pcc.register_uri('GET', URL_PCC_HOST + '/users/current', reason='', text=json.dumps(user))
+    adapter_pcc.register_uri('GET', URL_PCC_HOST + '/users/{}/quota'.format(USER_ID),
+                             reason='', text=json.dumps(quota))
+    adapter_pcc.register_uri('POST', URL_PCC_HOST + '/users/{}/mailings'.format(USER_ID),
+                             reason='', text=json.dumps(mailings), headers=mailing_headers, status_code=201)
+    adapter_pcc.register_uri('POST', URL_PCC_HOST + '/users/{}/assets'.format(USER_ID),
+                             reason='', text='', headers=asset_headers, status_code=201)
+    adapter_pcc.register_uri('PUT', url_mailing + '/recipients', reason='', text='', status_code=204)
+    adapter_pcc.register_uri('PUT', url_mailing + '/pages/1', reason='', text='', status_code=204)
+    adapter_pcc.register_uri('PUT', url_mailing + '/pages/2', reason='', text='', status_code=204)
+    adapter_pcc.register_uri('POST', url_mailing + '/order', reason='', text='{}', status_code=200)
+
+
+def requested_paths(adapter):
+    return [(r.method, r.path) for r in adapter.request_history]
+
+
+def test_pcc_send_free_card_successful():
+    pcc = create_postcard_creator()
+    register_pcc_endpoints()
+
+    response = pcc.send_free_card(create_postcard())
+
+    assert response.status_code == 200
+    paths = requested_paths(adapter_pcc)
+    assert paths[-1] == ('POST', '/rest/2.1/users/{}/mailings/{}/order'.format(USER_ID, MAILING_ID))
+    page_1 = [r for r in adapter_pcc.request_history if r.path.endswith('/pages/1')][0]
+    assert ASSET_ID in page_1.text
+
+
+def test_pcc_send_free_card_quota_exceeded():
+    pcc = create_postcard_creator()
+    register_pcc_endpoints(available=False)
+
+    with pytest.raises(PostcardCreatorException):
+        pcc.send_free_card(create_postcard())
+    assert not any(method == 'POST' for method, _ in requested_paths(adapter_pcc))
+
+
+def test_token_cache_reuses_token():
+    cache = MemoryTokenCache()
+    token = create_token_with_successful_login()
+    token.cache = cache
+    token.fetch_token('username', 'password')
+    calls = adapter_token.call_count
+
+    other = create_token_with_successful_login()
+    other.cache = cache
+    other.fetch_token('username', 'password')
+
+    assert adapter_token.call_count == 0
+    assert calls > 0
+    assert other.token == 0
+    assert other.is_valid()
+
+
+def test_token_cache_refreshes_before_expiry(tmpdir):
+    cache = FileTokenCache(str(tmpdir.join('tokens.json')))
+    token = create_token_with_successful_login()
+    token.cache = cache
+    token.fetch_token('username', 'password')
+
+    # refresh_margin larger than expires_in forces a new login
+    other = create_token_with_successful_login()
+    other.cache = cache
+    other.refresh_margin = 7200
+    other.fetch_token('username', 'password')
+    assert adapter_token.call_count > 0
+
+    other = create_token_with_successful_login()
+    other.cache = FileTokenCache(str(tmpdir.join('tokens.json')))
+    other.fetch_token('username', 'password')
+    assert adapter_token.call_count == 0
+
+
+def test_token_learns_idp():
+    cache = MemoryTokenCache()
+    token = create_token_with_successful_login()
+    token.cache = cache
+    token.fetch_token('username', 'password')
+
+    assert token.idp == 'post'
+    assert cache.get(token_cache_key('username', 'password', 'mock://'))['idp'] == 'post'
+
 
-    adapter_pcc.register_uri('GET', URL_USERS_CURRENT, reason='', text=json.dumps(user))
-    adapter_pcc.register_uri('GET', URL_USERS_QUOTA, reason='', text=json.dumps(quota))
-    adapter_pcc.register_uri('POST', URL_USERS_MAILINGS,
-                             reason='', text=json.dumps(mailings), headers=mailing_headers)
+def test_token_swissid_hint_skips_post_login():
+    token = create_token_with_successful_login()
+    token.idp = 'swissid'
+    token._swissid_get_saml_response = lambda session, username, password: 'saml'
+    token.fetch_token('username', 'password')
+
+    assert requested_paths(adapter_token) == [('POST', '/saml/sso/alias/defaultalias')]
+    assert token.idp == 'swissid'
+
+
+def test_token_wrong_idp_hint_falls_back(tmpdir):
+    cache = FileTokenCache(str(tmpdir.join('tokens.json')))
+    cache.set(token_cache_key('username', 'password', 'mock://'), {'token': None, 'idp': 'swissid'})
+    token = create_token_with_successful_login()
+    token.cache = cache
+    token._swissid_get_saml_response = lambda session, username, password: {}['not swissid']
+    token.fetch_token('username', 'password')
+
+    assert token.token == 0
+    assert token.idp == 'post'
+    assert cache.get(token_cache_key('username', 'password', 'mock://'))['idp'] == 'post'
+
+
+def test_token_swissid_connection_error_is_raised():
+    token = create_token_with_successful_login()
+    token.idp = 'swissid'
+
+    def swissid_login(session, username, password):
+        raise requests.exceptions.ConnectionError('connection refused')
+
+    token._swissid_get_saml_response = swissid_login
+    with pytest.raises(requests.exceptions.ConnectionError):
+        token.fetch_token('username', 'password')
+    assert requested_paths(adapter_token) == []
+
+
+def test_token_cache_key_depends_on_credentials():
+    assert token_cache_key('user', 'a') != token_cache_key('user', 'b')
+    assert token_cache_key('user', 'a') == token_cache_key('user', 'a')
+
+
+def test_pcc_send_mailing_to_many_recipients():
+    pcc = create_postcard_creator()
+    register_pcc_endpoints()
+    postcard = create_postcard()
+    recipients = [Recipient(prename='Hans {}'.format(i), lastname='Meier', street='Street 2', zip_code=3000,
+                            place='Bern') for i in range(3)]
+    scale_picture = pcc._scale_picture
+    scaled = []
+    pcc._scale_picture = lambda *args, **kwargs: scaled.append(1) or scale_picture(*args, **kwargs)
+
+    responses = list(pcc.send_mailing(postcard.sender, recipients, postcard.picture_stream, message='Hoi'))
+
+    assert [r.status_code for r in responses] == [200] * 3
+    assert len(scaled) == 1
+    mailings = [r for r in adapter_pcc.request_history if r.path.endswith('/mailings')]
+    assert len(mailings) == 3 and all(m.json()['paid'] is False for m in mailings)
+    pages = [r.text for r in adapter_pcc.request_history if r.path.endswith('/pages/2')]
+    assert all('Hoi' in page and 'Hans {}'.format(i) in page for i, page in enumerate(pages))
+
+
+def test_pcc_send_mailing_stops_without_quota():
+    pcc = create_postcard_creator()
+    register_pcc_endpoints(available=False)
+    postcard = create_postcard()
+
+    with pytest.raises(PostcardCreatorException):
+        list(pcc.send_mailing(postcard.sender, [postcard.recipient], postcard.picture_stream))
+    assert not [r for r in adapter_pcc.request_history if r.method == 'POST']
+
+
+def test_pcc_send_free_card_pipelined():
+    pcc = create_postcard_creator()
+    register_pcc_endpoints()
+
+    response = pcc.send_free_card(create_postcard(), pipeline=True)
+
+    assert response.status_code == 200
+    paths = requested_paths(adapter_pcc)
+    assert paths[-1] == ('POST', '/rest/2.1/users/{}/mailings/{}/order'.format(USER_ID, MAILING_ID))
+    assert len([p for p in paths if p[0] == 'PUT']) == 3
+
+
+@pytest.mark.parametrize('available, mailing_status', [(False, 201), (True, 500)])
+def test_pcc_send_free_card_pipelined_closes_picture_on_error(available, mailing_status):
+    pcc = create_postcard_creator()
+    register_pcc_endpoints(available=available)
+    adapter_pcc.register_uri('POST', URL_PCC_HOST + '/users/{}/mailings'.format(USER_ID), status_code=mailing_status,
+                             headers={'Location': '/mailings/{}'.format(MAILING_ID)})
+    scaled = []
+
+    def scale_picture(picture_stream, **kwargs):
+        scaled.append(tempfile.SpooledTemporaryFile())
+        return scaled[-1]
+
+    pcc._scale_picture = scale_picture
+    with pytest.raises(PostcardCreatorException):
+        pcc.send_free_card(create_postcard(), pipeline=True)
+
+    assert len(scaled) == 1 and scaled[0].closed
+
+
+def test_pcc_upload_keeps_small_picture_in_memory():
+    pcc = create_postcard_creator()
+    register_pcc_endpoints()
+    scale_picture = pcc._scale_picture
+    scaled = []
+
+    def spy(*args, **kwargs):
+        picture = scale_picture(*args, **kwargs)
+        scaled.extend([picture, picture.read()])
+        picture.seek(0)
+        return picture
+
+    def upload(request, context):
+        # the body is streamed, it is read while the request is sent
+        bodies.append(request.body.read())
+        context.status_code = 201
+        context.headers['Location'] = 'https://postcardcreator.post.ch/rest/2.1/users/{}/assets/user/{}'.format(
+            USER_ID, ASSET_ID)
+        return ''
+
+    bodies = []
+    adapter_pcc.register_uri('POST', URL_PCC_HOST + '/users/{}/assets'.format(USER_ID), text=upload)
+    pcc._scale_picture = spy
+    pcc.send_free_card(create_postcard(), mock_send=True)
+
+    picture, data = scaled
+    assert isinstance(picture, tempfile.SpooledTemporaryFile) and not picture._rolled
+    assert data in bodies[0]
+
+
+def test_pcc_user_info_and_quota_cached():
+    pcc = create_postcard_creator()
+    register_pcc_endpoints()
+
+    pcc.send_free_card(create_postcard())
+    paths = requested_paths(adapter_pcc)
+    assert paths.count(('GET', '/rest/2.1/users/current')) == 1
+    assert paths.count(('GET', '/rest/2.1/users/{}/quota'.format(USER_ID))) == 1
+    assert pcc.cache_hits > 0
+
+    # quota is stale after ordering a card
+    pcc.get_quota()
+    paths = requested_paths(adapter_pcc)
+    assert paths.count(('GET', '/rest/2.1/users/{}/quota'.format(USER_ID))) == 2
+    assert paths.count(('GET', '/rest/2.1/users/current')) == 1
+
+
+def test_pcc_cache_disabled():
+    pcc = create_postcard_creator()
+    pcc.cache_ttl = 0
+    register_pcc_endpoints()
 
-    #pcc.send_free_card(postcard)
+    pcc.get_user_info()
+    pcc.get_user_info()
+    assert requested_paths(adapter_pcc).count(('GET', '/rest/2.1/users/current')) == 2
+    assert pcc.cache_hits == 0
@@ -0,0 +1,37 @@
+import requests_mock
+
+from postcard_creator import aio
+from postcard_creator.transport import Transport
+
+
+def test_sessions_share_connection_pools():
+    transport = Transport(pool_maxsize=4, pool_sizes={'https://postcardcreator.post.ch': 20})
+    session1 = transport.create_session()
+    session2 = transport.create_session()
+
+    assert session1.get_adapter('https://account.post.ch/') is session2.get_adapter('https://account.post.ch/')
+    assert session1.cookies is not session2.cookies
+    adapter = session1.get_adapter('https://postcardcreator.post.ch/rest/2.1/users/current')
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] == 20
+
+    session1.close()
+    assert session2.get_adapter('https://account.post.ch/').poolmanager.pools is not None
+
+
+def test_default_pool_covers_async_threads():
+    adapter = Transport().create_session().get_adapter('https://postcardcreator.post.ch/')
+
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] >= aio.DEFAULT_MAX_WORKERS
+
+
+def test_session_default_timeout():
+    session = Transport(timeout=(3, 7)).create_session()
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('GET', 'mock://host/', text='')
+    session.mount('mock', adapter)
+
+    session.get('mock://host/')
+    session.get('mock://host/', timeout=1)
+
+    assert [r.timeout for r in adapter.request_history] == [(3, 7), 1]
+
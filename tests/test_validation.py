@@ -0,0 +1,51 @@
+from postcard_creator.postcard_creator import Postcard, Recipient, Sender
+from postcard_creator.validation import validate_postcards, validate_recipients, validate_senders
+
+
+def create_recipient(**kwargs):
+    fields = dict(prename='Hans', lastname='Meier', street='Street 2', zip_code=3000, place='Bern')
+    fields.update(kwargs)
+    return Recipient(**fields)
+
+
+def test_validate_recipients():
+    recipients = [
+        create_recipient(),
+        create_recipient(zip_code='80000'),
+        create_recipient(prename=''),
+        create_recipient(street='x' * 40),
+        create_recipient(place='Bern\x00'),
+    ]
+
+    errors = list(validate_recipients(recipients, batch_size=2))
+
+    assert [(e.row, e.field) for e in errors] == [
+        (1, 'zip_code'), (2, 'prename'), (3, 'street'), (4, 'place')]
+
+
+def test_validate_columns():
+    columns = {
+        'prename': ['Hans', 'Eva'],
+        'lastname': ['Meier', 'Müller'],
+        'street': ['Street 2', 'Street 3'],
+        'zip_code': ['3000', 'ABCD'],
+        'place': ['Bern'],
+    }
+
+    errors = list(validate_recipients(columns))
+
+    assert [(e.row, e.field) for e in errors] == [(1, 'place'), (1, 'zip_code')]
+
+
+def test_validate_senders_and_postcards():
+    sender = Sender(prename='Anna', lastname='Muster', street='Street 1', zip_code='D-10115', place='Berlin')
+    assert list(validate_senders([sender])) == []
+
+    postcards = [
+        Postcard(sender=sender, recipient=create_recipient(), picture_stream=None, message='hi'),
+        Postcard(sender=Sender(prename='', lastname='x', street='s', zip_code=1, place='p'),
+                 recipient=create_recipient(), picture_stream=None, message='x' * 1000),
+    ]
+    errors = list(validate_postcards(postcards))
+
+    assert [(e.row, e.field) for e in errors] == [(1, 'message'), (1, 'sender.prename')]